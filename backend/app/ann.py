@@ -0,0 +1,183 @@
+# Path: backend/ann.py
+# Purpose: In-process approximate nearest-neighbour index (IVF)
+# Design:
+# - Spherical k-means splits the normalized embeddings into n_lists cells
+# - A query scores only the rows of the n_probe closest cells
+# - n_lists / n_probe trade recall for speed (n_probe = n_lists is exact)
+#
+# Benchmark recall@k against exact search:
+#   python ann.py                      (stored index)
+#   python ann.py --synthetic 200000   (random corpus)
+
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Rows per block when assigning rows to cells, bounds temporary memory
+_ASSIGN_BLOCK = 65536
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    labels = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), _ASSIGN_BLOCK):
+        block = np.asarray(x[start:start + _ASSIGN_BLOCK], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """Inverted-file index over the rows of a normalized embedding matrix"""
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray,
+                 offsets: np.ndarray, n_rows: int):
+        self.centroids = centroids   # (n_lists, dim) float32
+        self.order = order           # row numbers grouped by cell
+        self.offsets = offsets       # cell c owns order[offsets[c]:offsets[c+1]]
+        self.n_rows = n_rows
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_lists: Optional[int] = None,
+              n_iter: int = 10, seed: int = 0,
+              max_train_per_list: int = 256) -> "IVFIndex":
+        n = len(matrix)
+        if n == 0:
+            raise ValueError("Cannot build an IVF index over an empty matrix")
+
+        n_lists = min(n_lists or max(1, int(np.sqrt(n))), n)
+        rng = np.random.default_rng(seed)
+
+        # Train on a sample; assignment of all rows happens once at the end
+        train_size = min(n, n_lists * max_train_per_list)
+        train_rows = np.sort(rng.choice(n, train_size, replace=False))
+        train = np.asarray(matrix[train_rows], dtype=np.float32)
+
+        centroids = train[rng.choice(train_size, n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, train)
+            counts = np.bincount(labels, minlength=n_lists)
+
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty cells with random training rows
+                sums[empty] = train[rng.choice(train_size, int(empty.sum()))]
+            centroids = _normalize_rows(sums).astype(np.float32)
+
+        labels = _assign(matrix, centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+
+        return cls(centroids, order, offsets, n)
+
+    def candidates(self, vector: np.ndarray, n_probe: int) -> np.ndarray:
+        """Row numbers in the n_probe cells closest to vector"""
+        n_probe = min(max(n_probe, 1), self.n_lists)
+        scores = self.centroids @ np.asarray(vector, dtype=np.float32)
+        cells = np.argpartition(-scores, n_probe - 1)[:n_probe]
+        return np.concatenate(
+            [self.order[self.offsets[c]:self.offsets[c + 1]] for c in cells]
+        )
+
+    def save(self, path: Path):
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                order=self.order,
+                offsets=self.offsets,
+                n_rows=np.int64(self.n_rows)
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(
+                data["centroids"],
+                data["order"],
+                data["offsets"],
+                int(data["n_rows"])
+            )
+
+
+def benchmark(matrix: np.ndarray, k: int = 3, n_queries: int = 200,
+              n_lists: Optional[int] = None, probes=(1, 2, 4, 8, 16, 32),
+              noise: float = 0.05, seed: int = 0):
+    """Print recall@k and per-query latency of IVF vs exact search.
+
+    Queries are stored vectors with gaussian noise, so the exact top-k is
+    known to be meaningful for any corpus.
+    """
+    rng = np.random.default_rng(seed)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    k = min(k, len(matrix))
+
+    queries = matrix[rng.choice(len(matrix), min(n_queries, len(matrix)), replace=False)]
+    queries = _normalize_rows(queries + rng.normal(0, noise, queries.shape)).astype(np.float32)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(matrix, n_lists)
+    build_s = time.perf_counter() - start
+    print(f"rows={len(matrix)} dim={matrix.shape[1]} lists={index.n_lists} "
+          f"build={build_s:.2f}s k={k}")
+
+    def top_k(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    start = time.perf_counter()
+    exact = [set(top_k(matrix @ q)) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"exact        recall@{k}=1.000  {exact_ms:.3f} ms/query")
+
+    for n_probe in probes:
+        if n_probe > index.n_lists:
+            break
+        hits = 0
+        start = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            rows = index.candidates(q, n_probe)
+            found = rows[top_k(matrix[rows] @ q)] if len(rows) >= k else rows
+            hits += len(truth.intersection(found.tolist()))
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"n_probe={n_probe:<4} recall@{k}={hits / (k * len(queries)):.3f}  "
+              f"{ann_ms:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="IVF recall/latency benchmark")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="benchmark a random corpus of this many rows")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        # Clustered data, closer to real embeddings than uniform noise
+        rng = np.random.default_rng(0)
+        centers = _normalize_rows(rng.normal(size=(max(args.synthetic // 500, 1), args.dim)))
+        data = centers[rng.integers(len(centers), size=args.synthetic)]
+        data = _normalize_rows(data + rng.normal(0, 0.3 / np.sqrt(args.dim), data.shape))
+    else:
+        from config import STORAGE_DIR
+        from vector_store import NumpyVectorStore
+        data = NumpyVectorStore.from_persist_dir(str(STORAGE_DIR)).matrix
+
+    benchmark(data, k=args.k, n_queries=args.queries, n_lists=args.lists)
@@ -0,0 +1,131 @@
+# Path: backend/bm25.py
+# Purpose: BM25 keyword scoring for hybrid retrieval
+# Design:
+# - Term counts are computed once per node at ingestion and stored with it
+# - The inverted index (term -> rows, term frequencies) is derived from
+#   them as NumPy CSR arrays, so a query touches only its terms' postings;
+#   snapshots store the arrays, so workers load it memory-mapped
+# - Amounts keep their digits ("₹25,000" -> 25000), so exact figures,
+#   acronyms (LTV, CIBIL, EMI) and rare words match literally
+
+import math
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Array files written by BM25Index.save()
+_ARRAYS = ("vocab", "indptr", "rows", "tfs", "idf", "norm")
+
+_TOKEN = re.compile(r"\d[\d,]*(?:\.\d+)?|[a-z]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from have how i if in is it me my
+of on or our the this to what when where which who will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = (t.replace(",", "") for t in _TOKEN.findall(text.lower()))
+    return [t for t in tokens if t not in STOPWORDS]
+
+
+def term_counts(text: str) -> Dict[str, int]:
+    return dict(Counter(tokenize(text)))
+
+
+class BM25Index:
+    """Okapi BM25 over a list of per-row term counts.
+
+    Postings are CSR arrays over a sorted vocabulary: term i's rows and
+    term frequencies are rows[indptr[i]:indptr[i + 1]] and tfs[...].
+    save()/load() keep them as .npy files, loaded memory-mapped, so a
+    worker starts without rebuilding the index in Python.
+    """
+
+    def __init__(self, rows_terms: List[Dict[str, int]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_rows = len(rows_terms)
+
+        postings = {}
+        lengths = np.zeros(self.n_rows, dtype=np.float32)
+        for row, terms in enumerate(rows_terms):
+            lengths[row] = sum(terms.values())
+            for term, tf in terms.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(row)
+                postings[term][1].append(tf)
+
+        avg_length = float(lengths.mean()) if self.n_rows and lengths.any() else 1.0
+        # Per-row length normalization, precomputed once
+        self._norm = (k1 * (1 - b + b * lengths / avg_length)).astype(np.float32)
+
+        vocabulary = sorted(postings)
+        self._vocab = np.asarray(vocabulary, dtype=str)
+        self._indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        self._idf = np.zeros(len(vocabulary), dtype=np.float32)
+        for i, term in enumerate(vocabulary):
+            df = len(postings[term][0])
+            self._indptr[i + 1] = self._indptr[i] + df
+            self._idf[i] = math.log(1 + (self.n_rows - df + 0.5) / (df + 0.5))
+        self._rows = np.asarray(
+            [row for term in vocabulary for row in postings[term][0]], dtype=np.int64
+        )
+        self._tfs = np.asarray(
+            [tf for term in vocabulary for tf in postings[term][1]], dtype=np.float32
+        )
+
+    def save(self, directory: Path):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        arrays = {"params": np.asarray([self.k1, self.b], dtype=np.float64)}
+        arrays.update((name, getattr(self, f"_{name}")) for name in _ARRAYS)
+        for name, array in arrays.items():
+            # Replace, never overwrite in place: the old file may be mapped
+            path = directory / f"{name}.npy"
+            tmp_path = directory / f"{name}.npy.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, directory: Path, mmap_mode: Optional[str] = "r") -> "BM25Index":
+        directory = Path(directory)
+        index = cls.__new__(cls)
+        index.k1, index.b = (float(v) for v in np.load(directory / "params.npy"))
+        for name in _ARRAYS:
+            setattr(index, f"_{name}", np.load(directory / f"{name}.npy", mmap_mode=mmap_mode))
+        index.n_rows = len(index._norm)
+        return index
+
+    def row_terms(self) -> List[Dict[str, int]]:
+        """Per-row term counts back from the postings (for a store loaded
+        from arrays that is then modified)"""
+        terms = [{} for _ in range(self.n_rows)]
+        for i, term in enumerate(self._vocab.tolist()):
+            start, end = self._indptr[i], self._indptr[i + 1]
+            for row, tf in zip(self._rows[start:end].tolist(), self._tfs[start:end].tolist()):
+                terms[row][term] = int(tf)
+        return terms
+
+    def _postings(self, term: str):
+        i = int(np.searchsorted(self._vocab, term))
+        if i == len(self._vocab) or self._vocab[i] != term:
+            return None
+        start, end = self._indptr[i], self._indptr[i + 1]
+        return self._rows[start:end], self._tfs[start:end], self._idf[i]
+
+    def scores(self, query: str) -> Optional[np.ndarray]:
+        """BM25 score of every row, None if no query term is indexed"""
+        postings = [p for p in map(self._postings, set(tokenize(query))) if p is not None]
+        if not postings:
+            return None
+
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for rows, tfs, idf in postings:
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[rows])
+        return scores
@@ -0,0 +1,213 @@
+# Path: backend/cache.py
+# Purpose: In-process caches used by the RAG engine
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+_PUNCTUATION = re.compile(r"[^\w\s%₹.]|(?<!\d)\.|\.(?!\d)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop punctuation (keeping %, ₹ and decimal points) and
+    collapse whitespace, so trivially different spellings share a key"""
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry time-to-live and hit/miss counters"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class SemanticCache:
+    """Answers of previously seen questions, matched by embedding similarity.
+
+    Question embeddings live in one normalized float32 matrix so a lookup
+    is a single matrix-vector product. When full, the least recently
+    used entry is overwritten. Entries belong to one index version and
+    are dropped when the version changes. Each entry also records the
+    loan type the question was resolved to, and only matches questions
+    about the same one: "gold loan interest rate" and "home loan interest
+    rate" are close in embedding space but need different answers.
+    """
+
+    def __init__(self, capacity: int, threshold: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._matrix = None
+        self._answers = [None] * capacity
+        self._loan_types = np.full(capacity, None, dtype=object)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _reset(self, version, dim: int):
+        self._matrix = np.zeros((self.capacity, dim), dtype=np.float32)
+        self._answers = [None] * self.capacity
+        self._loan_types[:] = None
+        self._last_used[:] = 0
+        self._size = 0
+        self._version = version
+
+    def get(self, embedding, version, loan_type=None):
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if self._size == 0 or version != self._version:
+                self.misses += 1
+                return None
+
+            scores = self._matrix[:self._size] @ vector
+            scores[self._loan_types[:self._size] != loan_type] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._last_used[best] = time.monotonic()
+            self.hits += 1
+            return self._answers[best]
+
+    def set(self, embedding, answer: str, version, loan_type=None):
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if self._matrix is None or version != self._version \
+                    or self._matrix.shape[1] != vector.shape[0]:
+                self._reset(version, vector.shape[0])
+
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+
+            self._matrix[slot] = vector
+            self._answers[slot] = answer
+            self._loan_types[slot] = loan_type
+            self._last_used[slot] = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._matrix = None
+            self._answers = [None] * self.capacity
+            self._loan_types[:] = None
+            self._last_used[:] = 0
+            self._size = 0
+            self._version = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class EmbeddingCache:
+    """Query embeddings by normalized query text, least recently used
+    evicted. Vectors are kept as float32 arrays and handed out as lists.
+    They depend on the embedding model only, so a re-index keeps them."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str):
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return vector.tolist()
+
+    def set(self, text: str, embedding):
+        key = normalize_text(text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
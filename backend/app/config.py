@@ -7,6 +7,9 @@ load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent.parent
 DOCUMENTS_DIR = BASE_DIR / "documents"
 STORAGE_DIR = BASE_DIR / "storage"
+SNAPSHOT_DIR = STORAGE_DIR / "snapshot"
+KNOWLEDGE_FILE = BASE_DIR / "knowledge" / "knowledge.xlsx"
+DOCUMENTS_MANIFEST = STORAGE_DIR / "documents_manifest.json"  # file -> content hash
 
 DOCUMENTS_DIR.mkdir(exist_ok=True)
 STORAGE_DIR.mkdir(exist_ok=True)
@@ -16,14 +19,57 @@ if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY not found in .env file")
 
 GROQ_MODEL = "llama-3.3-70b-versatile"
+# Tokenizer of GROQ_MODEL, used to count every token budget. The
+# meta-llama repository is gated, this copy has the same tokenizer; when
+# it can't be loaded LlamaIndex's tiktoken cl100k_base is used, which
+# is close but not the same
+LLM_TOKENIZER = "unsloth/Llama-3.3-70B-Instruct"
 TEMPERATURE = 0.7
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 CHUNK_SIZE = 512
 CHUNK_OVERLAP = 50
+VECTOR_STORE_DTYPE = "float32"  # "float16" halves the stored files; scored as float32
+USE_INDEX_SNAPSHOT = True       # start from the mmap snapshot when it is fresh
+
+# Retrieval mode: "exact" brute force, or "ivf" approximate search for large
+# corpora (benchmark recall with: python ann.py)
+VECTOR_STORE_SETTINGS = {
+    "index_mode": "exact",
+    "ivf_lists": 0,         # cells; 0 = sqrt(number of nodes)
+    "ivf_probe": 8,         # cells scored per query; more = higher recall
+    "ann_min_nodes": 2000,  # below this exact search is already fast
+    "partition_key": "loan_type",  # one sub-index per loan type
+}
+
+# Search only the detected loan type's sections (plus general ones)
+ROUTE_BY_LOAN_TYPE = True
+
+# Chunks retrieved per question. Hybrid retrieval fuses the dense ranking
+# with BM25 keyword matches (LTV, CIBIL, amounts) by reciprocal rank fusion
+SIMILARITY_TOP_K = 3
+HYBRID_RETRIEVAL = True
+HYBRID_CANDIDATES = 10  # rows taken from each ranking before fusion
 
 # NEW: Context Awareness Settings
-MEMORY_TOKEN_LIMIT = 4000
-MAX_TOKENS = 1024
+MEMORY_TOKEN_LIMIT = 4000       # token budget for the synthesis prompt (rules + history + question)
+CONTEXT_TOKEN_LIMIT = 1536      # token budget for retrieved document context
+MAX_TOKENS = 150                # cap on the answer the LLM generates
+
+# Context compression: retrieved chunks are cut down to the sentences
+# relevant to the question (cosine vs the question embedding), without
+# near-duplicates across chunks, under a hard token cap
+CONTEXT_COMPRESSION = True
+COMPRESSION_THRESHOLD = 0.55        # bge-small cosine; unrelated text scores lower
+COMPRESSION_DEDUPE_THRESHOLD = 0.95
+COMPRESSION_MIN_SENTENCES = 3       # kept even when below the threshold
+COMPRESSED_CONTEXT_TOKENS = 600     # hard cap on the compressed context
+COMPRESSION_CACHE_SIZE = 4096       # sentence embeddings kept in memory
+
+# Rolling conversation summaries: turns older than the last
+# SUMMARY_KEEP_MESSAGES are folded into a per-session summary
+SUMMARY_MODE = False
+SUMMARY_KEEP_MESSAGES = 4
+SUMMARY_MAX_TOKENS = 200
 SYSTEM_PROMPT = """You are Lora, an AI finance assistant for Lora Finance company. 
 
 CRITICAL INSTRUCTIONS:
@@ -37,6 +83,36 @@ CRITICAL INSTRUCTIONS:
 About Lora Finance:
 We provide gold loans, personal loans, business loans, home loans, vehicle loans, and education loans with competitive rates."""
 
+# Pre-approved answers from knowledge.xlsx, served without retrieval or
+# LLM; only questions of at most KNOWLEDGE_MAX_WORDS words are matched.
+# Off until the table is the agreed source: its answers skip the
+# documents, and some rows disagree with them (gold loan interest is
+# 7%-14% in the table, 8.5%-10% in section 2.3)
+USE_KNOWLEDGE_BOX = False
+KNOWLEDGE_MAX_WORDS = 12
+
+# Exact-match answer cache (question + prior history + index version)
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 3600  # seconds
+
+# Semantic answer cache for history-independent questions (paraphrases)
+SEMANTIC_CACHE_SIZE = 512
+SEMANTIC_CACHE_THRESHOLD = 0.92  # cosine similarity needed for a hit
+
+# Query embeddings by normalized query text: a repeated question skips
+# the encoder even when its answer can't be cached (different history)
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+
+# Query embeddings of concurrent requests are collected for up to
+# EMBED_BATCH_WINDOW_MS (or EMBED_BATCH_MAX queries) and embedded in one
+# forward pass
+EMBED_BATCHING = True
+EMBED_BATCH_WINDOW_MS = 5
+EMBED_BATCH_MAX = 16
+
+# Re-index DOCUMENTS_DIR in the background when files change; changes
+# are debounced by WATCH_INTERVAL seconds
+WATCH_DOCUMENTS = True
 WATCH_INTERVAL = 2
 HOST = "0.0.0.0"
 PORT = 8000
\ No newline at end of file
@@ -0,0 +1,172 @@
+# Path: backend/context_compressor.py
+# Purpose: Shrink retrieved context before synthesis
+# Design:
+# - Chunks are split into sentences after joining wrapped lines (bullets
+#   and Q:/A: lines count as sentences)
+# - Sentences are scored against the question embedding; those below the
+#   threshold are dropped, except the best min_sentences
+# - Near-duplicate sentences across chunks are dropped (cosine >= dedupe)
+# - The best sentences are kept up to a hard token cap, then put back in
+#   reading order; each chunk keeps its heading line
+# - Sentence embeddings and token counts are cached: the same chunks are
+#   retrieved often
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore
+
+from prompt_builder import count_tokens
+from section_parser import TOKEN_COUNT_KEY
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# A line that starts a new unit: a "- " bullet, a numbered heading or
+# item ("2.2 KEY FEATURES", "1. Visit") or a label such as "Q:", "A:",
+# "Option 1:", "For Salaried:"; any other line continues the one before
+# it (the documents wrap prose at ~80 columns)
+_UNIT_START = re.compile(r"^(?:- |\d+\.\d*\s+[A-Z]|[A-Z][\w/()-]*(?: [\w/()-]+){0,3}:(?:\s|$))")
+# Headings and rules ("2.2 KEY FEATURES", "====") are never continued
+_NO_CONTINUATION = re.compile(r"^[^a-z]+$")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+(?=[A-Z₹(\"'])")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of text, with wrapped lines joined first"""
+    sentences = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        lines = []
+        for line in paragraph.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if lines and not _UNIT_START.match(line) \
+                    and not _NO_CONTINUATION.match(lines[-1]):
+                lines[-1] += " " + line
+            else:
+                lines.append(line)
+        for line in lines:
+            sentences.extend(s.strip() for s in _SENTENCE_BREAK.split(line) if s.strip())
+    return sentences
+
+
+class ContextCompressor(BaseNodePostprocessor):
+    """Keep only the retrieved sentences relevant to the question"""
+
+    embed_model: Any = None
+    threshold: float = 0.55
+    dedupe_threshold: float = 0.95
+    min_sentences: int = 3
+    token_limit: int = 600
+    cache_size: int = 4096
+
+    _cache: Any = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextCompressor"
+
+    def _lookup(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Normalized embeddings and token counts, from the cache where
+        possible"""
+        with self._lock:
+            cached = {t: self._cache[t] for t in texts if t in self._cache}
+            for t in cached:
+                self._cache.move_to_end(t)
+
+        missing = list(dict.fromkeys(t for t in texts if t not in cached))
+        if missing:
+            vectors = np.asarray(
+                self.embed_model.get_text_embedding_batch(missing), dtype=np.float32
+            )
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors /= norms
+
+            with self._lock:
+                for t, v in zip(missing, vectors):
+                    cached[t] = self._cache[t] = (v, count_tokens(t))
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        vectors = np.stack([cached[t][0] for t in texts])
+        tokens = np.asarray([cached[t][1] for t in texts], dtype=np.int64)
+        return vectors, tokens
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[Any] = None) -> List[NodeWithScore]:
+        if not nodes or self.embed_model is None \
+                or query_bundle is None or query_bundle.embedding is None:
+            return nodes
+
+        # (node index, text) per sentence; a node's first line is its
+        # heading, kept whenever any of its sentences is
+        units = []
+        is_heading = []
+        for n, node in enumerate(nodes):
+            heading, _, body = node.node.get_content().strip().partition("\n")
+            sentences = split_sentences(body)
+            if not sentences:
+                sentences, heading = [heading], ""
+            if heading.strip():
+                units.append((n, heading.strip()))
+                is_heading.append(True)
+            units.extend((n, sentence) for sentence in sentences)
+            is_heading.extend(False for _ in sentences)
+        if not units:
+            return nodes
+
+        vectors, tokens = self._lookup([t for _, t in units])
+        query = np.asarray(query_bundle.embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = vectors @ query
+
+        headings = {units[u][0]: u for u in range(len(units)) if is_heading[u]}
+        candidates = [u for u in np.argsort(-scores) if not is_heading[u]]
+
+        kept = []
+        used = 0
+        for rank, u in enumerate(candidates):
+            if scores[u] < self.threshold and rank >= self.min_sentences:
+                break
+            if kept and float(np.max(vectors[kept] @ vectors[u])) >= self.dedupe_threshold:
+                continue
+            n = units[u][0]
+            cost = int(tokens[u])
+            if n in headings and headings[n] not in kept:
+                cost += int(tokens[headings[n]])
+            # Always keep the best sentence, even if it alone exceeds the cap
+            if kept and used + cost > self.token_limit:
+                continue
+            kept.append(int(u))
+            if n in headings and headings[n] not in kept:
+                kept.append(headings[n])
+            used += cost
+
+        # Back to reading order (units are in it), grouped by node
+        by_node = {}
+        for u in sorted(kept):
+            by_node.setdefault(units[u][0], []).append(u)
+
+        compressed = []
+        for n, kept_units in by_node.items():
+            original = nodes[n].node
+            node = original.copy()
+            node.text = "\n".join(units[u][1] for u in kept_units)
+            if TOKEN_COUNT_KEY in original.metadata:
+                # Metadata header unchanged, only the dropped sentences go
+                node_units = [u for u in range(len(units)) if units[u][0] == n]
+                node.metadata = {
+                    **original.metadata,
+                    TOKEN_COUNT_KEY: int(original.metadata[TOKEN_COUNT_KEY]
+                                         - tokens[node_units].sum()
+                                         + tokens[kept_units].sum())
+                }
+            compressed.append(NodeWithScore(node=node, score=nodes[n].score))
+        return compressed
@@ -0,0 +1,92 @@
+# Path: backend/doc_watcher.py
+# Purpose: Re-index DOCUMENTS_DIR in the background when files change
+# Design:
+# - A daemon thread waits for changes (watchfiles, or polling if it is
+#   not installed) and debounces them by WATCH_INTERVAL seconds
+# - engine.refresh_documents() builds the updated index off the request
+#   path and swaps it in atomically; in-flight requests finish on the
+#   index they started with
+
+import logging
+import threading
+from pathlib import Path
+
+from config import DOCUMENTS_DIR, WATCH_INTERVAL
+from ingestion import DOCUMENT_PATTERN, scan_documents
+
+try:
+    from watchfiles import watch
+except ImportError:
+    watch = None
+
+logger = logging.getLogger(__name__)
+
+_watcher_stop = threading.Event()
+_watcher_thread = None
+
+
+def _refresh(engine):
+    try:
+        engine.refresh_documents()
+    except Exception as e:
+        logger.error(f"Document re-index failed: {e}")
+
+
+def _is_document(change, path: str) -> bool:
+    return Path(path).match(DOCUMENT_PATTERN)
+
+
+def _watch_loop(engine, documents_dir: Path, interval_s: float):
+    # Each yielded batch is already debounced by interval_s
+    for _ in watch(
+        documents_dir,
+        watch_filter=_is_document,
+        debounce=int(interval_s * 1000),
+        stop_event=_watcher_stop,
+        rust_timeout=1000
+    ):
+        _refresh(engine)
+
+
+def _poll_loop(engine, documents_dir: Path, interval_s: float):
+    # Re-index once the directory has stopped changing for one interval
+    last_seen = scan_documents(documents_dir)
+    pending = False
+    while not _watcher_stop.wait(interval_s):
+        try:
+            current = scan_documents(documents_dir)
+        except OSError:
+            continue
+
+        if current != last_seen:
+            last_seen = current
+            pending = True
+        elif pending:
+            pending = False
+            _refresh(engine)
+
+
+def start_document_watcher(engine, documents_dir: Path = DOCUMENTS_DIR,
+                           interval_s: float = WATCH_INTERVAL):
+    """Keep engine's index in sync with documents_dir in a background thread"""
+    global _watcher_thread
+    if _watcher_thread is not None and _watcher_thread.is_alive():
+        return
+
+    _watcher_stop.clear()
+    _watcher_thread = threading.Thread(
+        target=_watch_loop if watch is not None else _poll_loop,
+        args=(engine, Path(documents_dir), interval_s),
+        name="document-watcher",
+        daemon=True
+    )
+    _watcher_thread.start()
+    logger.info(f"👀 Watching {documents_dir} for document changes")
+
+
+def stop_document_watcher():
+    global _watcher_thread
+    _watcher_stop.set()
+    if _watcher_thread is not None:
+        _watcher_thread.join(timeout=5)
+        _watcher_thread = None
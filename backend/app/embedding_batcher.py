@@ -0,0 +1,132 @@
+# Path: backend/embedding_batcher.py
+# Purpose: Micro-batch query embeddings across concurrent requests
+# Design:
+# - Requests queue their text and wait on a Future; one background thread
+#   collects what arrives within window_ms (or max_batch texts) and runs
+#   it as a single batched forward pass
+# - Identical texts in a batch are embedded once; cancelled waiters are
+#   skipped and a failed pass fails its waiters, never the thread
+# - A lone request pays at most window_ms extra; under load, cores do a
+#   few large passes instead of many batch-size-1 passes
+# - stats() reports batch counts, sizes and forward-pass time
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEmbeddingBatcher:
+    """Background batcher in front of a batched embedding function"""
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]],
+                 window_ms: float = 5, max_batch: int = 16):
+        self.embed_batch = embed_batch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+        self.forward_seconds = 0.0
+        self.failures = 0
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        with self._cond:
+            self._pending.append((text, future))
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(
+                    target=self._run, name="query-embedder", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._pending:
+                    return
+
+                # Let concurrent requests join the batch
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch and not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+
+            # Waiters that gave up (client disconnected) are dropped here;
+            # the rest can no longer be cancelled
+            batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._embed(batch)
+            except Exception as e:
+                # Never leave a waiter hanging or let the thread die
+                logger.error(f"Query embedding batch failed: {e}")
+                with self._stats_lock:
+                    self.failures += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _embed(self, batch: list):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        start = time.perf_counter()
+        vectors = dict(zip(texts, self.embed_batch(texts)))
+        elapsed = time.perf_counter() - start
+
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.forward_seconds += elapsed
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "window_ms": round(self.window * 1000, 3),
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "queries": self.queries,
+                "largest_batch": self.largest_batch,
+                "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+                "avg_forward_ms": round(self.forward_seconds * 1000 / self.batches, 2)
+                if self.batches else 0.0,
+                "failures": self.failures
+            }
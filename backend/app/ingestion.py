@@ -0,0 +1,141 @@
+# Path: backend/ingestion.py
+# Purpose: Incremental, hash-based sync of DOCUMENTS_DIR into the index
+# Design:
+# - Each file is indexed under its file name as ref doc id
+# - storage/documents_manifest.json maps file name -> sha256 of its content
+# - A sync chunks and embeds only new or changed files and deletes the
+#   nodes of removed ones, so embedding work follows the diff
+# - Indexed documents the manifest does not know about (storage built
+#   before the manifest existed) are treated as stale and replaced
+# - index_lock() serializes syncs across processes (every uvicorn worker
+#   runs its own watcher): one worker re-embeds and writes storage and
+#   the snapshot, the others then load its result
+# - Chunking is Settings.node_parser (SectionNodeParser, section_parser.py):
+#   chunks follow the numbered sections, so none spans two products
+
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from llama_index.core import Document, Settings
+from llama_index.core.schema import BaseNode
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, single worker only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Bump when the node layout changes: an old manifest then re-indexes all
+MANIFEST_VERSION = 6
+DOCUMENT_PATTERN = "*.txt"
+INDEX_LOCK_FNAME = ".index.lock"
+
+
+@contextmanager
+def index_lock(storage_dir: Path):
+    """Exclusive lock on storage_dir shared by all processes, held while
+    syncing documents and writing storage / snapshot"""
+    storage_dir = Path(storage_dir)
+    storage_dir.mkdir(parents=True, exist_ok=True)
+    with open(storage_dir / INDEX_LOCK_FNAME, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def scan_documents(documents_dir: Path) -> Dict[str, str]:
+    """File name -> content hash for every document in documents_dir"""
+    return {
+        path.name: file_sha256(path)
+        for path in sorted(Path(documents_dir).glob(DOCUMENT_PATTERN))
+    }
+
+
+def load_manifest(manifest_path: Path) -> Dict[str, str]:
+    """Hashes of the files the stored index was built from ({} if unknown)"""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return dict(manifest.get("files", {}))
+
+
+def save_manifest(manifest_path: Path, hashes: Dict[str, str]):
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": hashes}, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def load_nodes(path: Path) -> List[BaseNode]:
+    """Chunk one file. All nodes get the file name as ref doc id, so the
+    whole file is deleted/replaced as one document."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+
+    if not text:
+        return []
+
+    document = Document(
+        id_=path.name,
+        text=text,
+        metadata={"file_name": path.name}
+    )
+    return Settings.node_parser.get_nodes_from_documents([document])
+
+
+def sync_index(index, documents_dir: Path,
+               indexed: Dict[str, str]) -> Tuple[Dict[str, str], List[str], List[str]]:
+    """Bring index in line with documents_dir.
+
+    indexed is the manifest the index was built from. Returns
+    (current hashes, inserted file names, deleted doc ids).
+    """
+    current = scan_documents(documents_dir)
+    known = set(index.docstore.get_all_ref_doc_info() or {})
+
+    unchanged = {
+        name for name, digest in current.items()
+        if indexed.get(name) == digest and name in known
+    }
+    to_delete = sorted(known - unchanged)
+    to_insert = sorted(set(current) - unchanged)
+
+    for doc_id in to_delete:
+        index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+    for name in to_insert:
+        nodes = load_nodes(Path(documents_dir) / name)
+        if nodes:
+            index.insert_nodes(nodes)
+
+    if to_delete or to_insert:
+        logger.info(
+            f"📄 Documents synced: {len(to_insert)} (re)indexed, "
+            f"{len(to_delete)} removed, {len(unchanged)} unchanged"
+        )
+
+    return current, to_insert, to_delete
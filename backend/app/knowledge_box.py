@@ -0,0 +1,200 @@
+# Path: backend/knowledge_box.py
+# Purpose: Instant answers from the pre-approved Q&A in knowledge.xlsx
+# Design:
+# - Rows are loaded once into in-memory dicts: no embedding, no LLM
+# - intent_key "<loan>_loan_<topic>" (e.g. gold_loan_interest) gives the
+#   loan type and topic a row answers
+# - A question is answered from the table when it equals a row's question,
+#   or names exactly one loan type and one topic and nothing else (only
+#   filler words are left once those are removed); anything else, e.g.
+#   "gold loan interest for senior citizens", falls through to RAG
+
+import logging
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Canonical loan type -> words that name it. Detection drives a hard
+# retrieval filter, so words common outside loan names ("auto debit",
+# "study abroad") only count with "loan" after them
+LOAN_TYPES = {
+    "gold": ("gold",),
+    "personal": ("personal",),
+    "business": ("business", "msme", "sme"),
+    "home": ("home", "housing", "house", "mortgage"),
+    "vehicle": ("vehicle", "car", "bike", "two wheeler", "auto loan", "auto loans"),
+    "education": ("education", "student", "study loan", "study loans"),
+}
+
+# Canonical topic -> words that ask for it
+TOPICS = {
+    "interest": ("interest", "rate", "rates", "roi"),
+    "documents": ("document", "documents", "docs", "paperwork", "papers", "kyc"),
+    "eligibility": ("eligibility", "eligible", "qualify", "criteria"),
+    "fees": ("fee", "fees", "charges", "processing"),
+    "tenure": ("tenure", "duration", "repayment period"),
+    "amount": ("amount", "how much", "maximum", "limit"),
+}
+
+# Questions with these need the documents (and the LLM) to answer well
+NEEDS_REASONING = ("compare", "difference", "vs", "versus", "better",
+                   "calculate", "emi", "if", "why")
+
+
+def _phrase_patterns(vocabulary: Dict[str, tuple]) -> Dict[str, re.Pattern]:
+    return {
+        key: re.compile(r"\b(?:" + "|".join(map(re.escape, words)) + r")\b")
+        for key, words in vocabulary.items()
+    }
+
+
+# Words a plain "<loan> <topic>" question may contain besides those
+FILLER_WORDS = frozenset("""
+a about an any apply are can current details do does for get give i in
+info information is kindly know latest loan loans lora finance me my need
+of on please required share show tell the there to what whats which with
+you your
+""".split())
+
+_LOAN_PATTERNS = _phrase_patterns(LOAN_TYPES)
+_TOPIC_PATTERNS = _phrase_patterns(TOPICS)
+_REASONING_PATTERN = re.compile(
+    r"\b(?:" + "|".join(map(re.escape, NEEDS_REASONING)) + r")\b"
+)
+
+
+def detect_loan_types(text: str) -> Set[str]:
+    """Canonical loan types mentioned in text (already normalized or not)"""
+    text = normalize_text(text)
+    return {key for key, pattern in _LOAN_PATTERNS.items() if pattern.search(text)}
+
+
+def detect_topics(text: str) -> Set[str]:
+    text = normalize_text(text)
+    return {key for key, pattern in _TOPIC_PATTERNS.items() if pattern.search(text)}
+
+
+def _extra_words(text: str):
+    """Words of normalized text that are no loan type, topic or filler"""
+    for pattern in (*_LOAN_PATTERNS.values(), *_TOPIC_PATTERNS.values()):
+        text = pattern.sub(" ", text)
+    return [word for word in text.split() if word not in FILLER_WORDS]
+
+
+def names_only_loan_type(text: str) -> bool:
+    """"gold", "home loan please": a loan type and nothing else, i.e. an
+    answer to a clarification question"""
+    text = normalize_text(text)
+    if not detect_loan_types(text):
+        return False
+    for pattern in _LOAN_PATTERNS.values():
+        text = pattern.sub(" ", text)
+    return all(word in FILLER_WORDS for word in text.split())
+
+
+def names_only_topics(text: str) -> bool:
+    """"interest", "what documents?": loan topics and nothing else, i.e.
+    a bare attribute question with no loan type or other detail"""
+    text = normalize_text(text)
+    return bool(detect_topics(text)) and not detect_loan_types(text) \
+        and not _extra_words(text)
+
+
+def _parse_intent_key(intent_key: str) -> Optional[Tuple[str, str]]:
+    loan, sep, topic = intent_key.strip().lower().partition("_loan_")
+    if sep and loan in LOAN_TYPES and topic in TOPICS:
+        return loan, topic
+    return None
+
+
+class KnowledgeBox:
+    """Lookup table over the knowledge.xlsx rows"""
+
+    def __init__(self, rows, max_words: int = 12):
+        self.max_words = max_words
+        self._by_question: Dict[str, str] = {}
+        self._by_intent: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        for intent_key, question, answer in rows:
+            if not answer:
+                continue
+            if question:
+                self._by_question[normalize_text(question)] = answer
+            intent = _parse_intent_key(intent_key or "")
+            if intent is not None:
+                self._by_intent[intent] = answer
+
+    @classmethod
+    def from_excel(cls, path: Path, max_words: int = 12) -> "KnowledgeBox":
+        """Load the first sheet (columns intent_key, question, answer).
+        A missing file or openpyxl gives an empty box, i.e. RAG only."""
+        path = Path(path)
+        if not path.exists():
+            logger.warning(f"Knowledge file not found: {path}")
+            return cls([], max_words)
+
+        try:
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(path, read_only=True, data_only=True)
+            try:
+                sheet_rows = workbook.worksheets[0].iter_rows(values_only=True)
+                header = [str(c or "").strip().lower() for c in next(sheet_rows)]
+                columns = [header.index(name) for name in ("intent_key", "question", "answer")]
+                rows = [
+                    tuple(
+                        str(row[i]).strip() if i < len(row) and row[i] is not None else ""
+                        for i in columns
+                    )
+                    for row in sheet_rows
+                ]
+            finally:
+                workbook.close()
+        except Exception as e:
+            logger.error(f"Could not load knowledge file {path}: {e}")
+            return cls([], max_words)
+
+        box = cls(rows, max_words)
+        logger.info(f"📗 Knowledge Box loaded: {len(rows)} Q&A rows")
+        return box
+
+    def match(self, question: str, loan_type: Optional[str] = None) -> Optional[str]:
+        """Answer for question, or None. loan_type (resolved from the
+        conversation) is used when the question itself names none."""
+        text = normalize_text(question)
+
+        answer = self._by_question.get(text)
+        if answer is None and len(text.split()) <= self.max_words \
+                and not _REASONING_PATTERN.search(text):
+            loans = detect_loan_types(text)
+            if not loans and loan_type in LOAN_TYPES:
+                loans = {loan_type}
+            topics = detect_topics(text)
+            if len(loans) == 1 and len(topics) == 1 and not _extra_words(text):
+                answer = self._by_intent.get((loans.pop(), topics.pop()))
+
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "questions": len(self._by_question),
+                "intents": len(self._by_intent),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
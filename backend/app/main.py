@@ -1,21 +1,47 @@
 # Path: backend/main.py
 # Purpose: FastAPI server with session-wise memory
 
-from fastapi import FastAPI
+import json
+
+import anyio
+from fastapi import BackgroundTasks, FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from rag_engine import get_rag_engine
+from rag_engine import ERROR_RESPONSE, get_rag_engine
 from session_store import (
     init_db,
-    create_session_if_not_exists,
-    save_message,
-    get_recent_messages,
+    begin_chat_turn,
+    finish_chat_turn,
     clear_session,
-    activate_session
+    activate_session,
+    start_retention_job,
+    get_session_summary,
+    get_messages_after,
+    close_db
+)
+from prompt_builder import (
+    build_prompt,
+    build_retrieval_query,
+    history_digest,
+    resolve_loan_type,
+    clarification_for
+)
+from summarizer import ConversationSummarizer
+from knowledge_box import KnowledgeBox, detect_loan_types, detect_topics
+from doc_watcher import start_document_watcher, stop_document_watcher
+from config import (
+    SYSTEM_PROMPT,
+    HOST,
+    PORT,
+    SUMMARY_MODE,
+    WATCH_DOCUMENTS,
+    USE_KNOWLEDGE_BOX,
+    KNOWLEDGE_FILE,
+    KNOWLEDGE_MAX_WORDS
 )
-from prompt_builder import build_prompt
-from config import SYSTEM_PROMPT, HOST, PORT
 
 app = FastAPI()
 
@@ -27,7 +53,15 @@ app.add_middleware(
 )
 
 init_db()
+start_retention_job()
 rag_engine = get_rag_engine()
+summarizer = ConversationSummarizer(rag_engine.llm) if SUMMARY_MODE else None
+knowledge_box = (
+    KnowledgeBox.from_excel(KNOWLEDGE_FILE, KNOWLEDGE_MAX_WORDS)
+    if USE_KNOWLEDGE_BOX else None
+)
+if WATCH_DOCUMENTS:
+    start_document_watcher(rag_engine)
 
 
 class ChatRequest(BaseModel):
@@ -39,35 +73,200 @@ class SessionRequest(BaseModel):
     session_id: str
 
 
+@app.on_event("shutdown")
+def shutdown():
+    stop_document_watcher()
+    rag_engine.query_embedder.stop()
+    close_db()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+async def _begin_turn(session_id: str, user_message: str):
+    # Upsert + activate session, save user message and read history
+    # in one transaction (SQLite runs in the threadpool, off the event loop)
+    return await run_in_threadpool(begin_chat_turn, session_id, user_message)
+
+
+def _fast_answer(user_message: str, history, loan_type):
+    """Pre-LLM intent stage: an answer that needs no retrieval or LLM
+    call, or None to go through RAG"""
+    # Bare "interest" / "documents" with no loan type known yet
+    clarification = clarification_for(user_message, loan_type)
+    if clarification is not None:
+        return clarification
+
+    if knowledge_box is None:
+        return None
+    answer = knowledge_box.match(user_message, loan_type)
+    if answer is None and detect_loan_types(user_message) \
+            and not detect_topics(user_message):
+        # A bare loan type ("gold") answers a clarification: combine it
+        # with the previous question
+        answer = knowledge_box.match(
+            build_retrieval_query(history, user_message), loan_type
+        )
+    return answer
+
+
+async def _prepare_turn(session_id: str, user_message: str, history):
+    """Pre-LLM part of a RAG turn.
+
+    Returns (synthesis prompt, retrieval query, history digest).
+    """
+    summary = None
+    prompt_history = history
+    if summarizer is not None:
+        summary, last_id = await run_in_threadpool(get_session_summary, session_id)
+        if summary:
+            # Everything the summary does not cover yet, so no turn falls
+            # between the two (also when a summary update was skipped)
+            rows = await run_in_threadpool(get_messages_after, session_id, last_id)
+            prompt_history = [(role, content) for _, role, content in rows]
+
+    full_prompt = build_prompt(
+        SYSTEM_PROMPT,
+        prompt_history,
+        user_message,
+        summary=summary
+    )
+
+    # Retrieval embeds only the (condensed) question, not the full prompt
+    retrieval_query = build_retrieval_query(history, user_message)
+
+    # Answer cache key part for "what was said before this question"
+    history_key = history_digest(prompt_history, user_message, summary)
+
+    return full_prompt, retrieval_query, history_key
+
+
+def _schedule_summary(background_tasks: BackgroundTasks, session_id: str):
+    # Runs after the response has been sent
+    if summarizer is not None:
+        background_tasks.add_task(summarizer.update, session_id)
+
+
+@app.get("/cache-stats")
+def cache_stats():
+    stats = rag_engine.cache_stats()
+    if knowledge_box is not None:
+        stats["knowledge_box"] = knowledge_box.stats()
+    return stats
+
+
+@app.post("/reindex")
+async def reindex():
+    """Embed new/changed documents and drop removed ones"""
+    changed = await run_in_threadpool(rag_engine.refresh_documents)
+    return {"status": "reindexed" if changed else "unchanged"}
+
+
 @app.post("/chat")
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest, background_tasks: BackgroundTasks):
     session_id = req.session_id
     user_message = req.message
 
-    create_session_if_not_exists(session_id)
-    activate_session(session_id)  # Ensure session is active
-    save_message(session_id, "user", user_message)
+    history = await _begin_turn(session_id, user_message)
+    loan_type = resolve_loan_type(history, user_message)
 
-    history = get_recent_messages(session_id)
+    answer = _fast_answer(user_message, history, loan_type)
+    if answer is not None:
+        await run_in_threadpool(finish_chat_turn, session_id, answer)
+        _schedule_summary(background_tasks, session_id)
+        return {"response": answer, "sources": []}
 
-    full_prompt = build_prompt(
-        SYSTEM_PROMPT,
-        history,
-        user_message
+    full_prompt, retrieval_query, history_key = await _prepare_turn(
+        session_id, user_message, history
     )
 
-    result = rag_engine.query(full_prompt)
+    result = await rag_engine.aquery(
+        full_prompt,
+        retrieval_query,
+        question=user_message,
+        history_key=history_key,
+        loan_type=loan_type
+    )
 
-    save_message(session_id, "assistant", result["response"])
+    # The error fallback is not an answer: keep it out of the history
+    if result["response"] != ERROR_RESPONSE:
+        await run_in_threadpool(finish_chat_turn, session_id, result["response"])
+        _schedule_summary(background_tasks, session_id)
 
     return result
 
 
+async def _single_token(text: str):
+    yield text
+
+
+async def _close_stream(stream):
+    await stream.aclose()
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, background_tasks: BackgroundTasks):
+    """Same as /chat but streams the answer as server-sent events:
+    one `token` event per text delta, then a `done` event with the full
+    response once it has been saved."""
+    session_id = req.session_id
+    user_message = req.message
+
+    history = await _begin_turn(session_id, user_message)
+    loan_type = resolve_loan_type(history, user_message)
+    answer = _fast_answer(user_message, history, loan_type)
+
+    if answer is None:
+        full_prompt, retrieval_query, history_key = await _prepare_turn(
+            session_id, user_message, history
+        )
+
+    async def event_stream():
+        parts = []
+        if answer is not None:
+            tokens = _single_token(answer)
+        else:
+            tokens = rag_engine.astream(
+                full_prompt,
+                retrieval_query,
+                question=user_message,
+                history_key=history_key,
+                loan_type=loan_type
+            )
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield f"event: token\ndata: {json.dumps({'token': token})}\n\n"
+        finally:
+            # Also runs when the client disconnected or the stream failed:
+            # save what was streamed, without the error fallback (nothing
+            # if no text came). Shielded, the request may be cancelled
+            with anyio.CancelScope(shield=True):
+                await tokens.aclose()
+                reply = "".join(part for part in parts if part != ERROR_RESPONSE)
+                if reply:
+                    await run_in_threadpool(finish_chat_turn, session_id, reply)
+
+        done = {"response": "".join(parts), "sources": []}
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+    stream = event_stream()
+
+    # Background tasks run once the stream has completed or the client
+    # disconnected; closing the stream first saves a reply cut short
+    background_tasks.add_task(_close_stream, stream)
+    _schedule_summary(background_tasks, session_id)
+
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background_tasks
+    )
+
+
 @app.post("/clear-session")
 def clear_session_endpoint(req: SessionRequest):
     """Clear chat history for a session"""
@@ -6,7 +6,24 @@
 # - Assume sensible defaults for sub-types (offers, variants)
 # - Mention variants AFTER answering, not before
 
-from typing import List, Tuple
+import hashlib
+import logging
+from functools import lru_cache, partial
+from typing import Callable, List, Optional, Tuple
+
+from llama_index.core import Settings
+
+from cache import normalize_text
+from config import MEMORY_TOKEN_LIMIT
+from knowledge_box import (
+    LOAN_TYPES,
+    detect_loan_types,
+    detect_topics,
+    names_only_loan_type,
+    names_only_topics
+)
+
+logger = logging.getLogger(__name__)
 
 
 HIGH_LEVEL_AMBIGUOUS = {
@@ -22,23 +39,98 @@ HIGH_LEVEL_AMBIGUOUS = {
 }
 
 
+# Follow-ups this short usually lean on the previous turn for context
+FOLLOW_UP_MAX_WORDS = 6
+
+
 def _is_high_level_ambiguous(question: str) -> bool:
-    q = question.lower().strip()
-    return q in HIGH_LEVEL_AMBIGUOUS or len(q.split()) <= 2
+    """Bare loan-attribute questions ("interest", "what documents?");
+    anything more specific ("what is the maximum age limit?") goes to RAG"""
+    q = normalize_text(question)
+    if q in HIGH_LEVEL_AMBIGUOUS:
+        return True
+    return names_only_topics(q)
 
 
-def build_prompt(
-    system_prompt: str,
+def resolve_loan_type(
+    chat_history: List[Tuple[str, str]],
+    user_question: str
+) -> Optional[str]:
+    """Loan type the question is about: the one it names ("multiple" if
+    it names several), else the one the user named most recently"""
+    loans = detect_loan_types(user_question)
+    if loans:
+        # Several named: the question is specific, just not about one type
+        return loans.pop() if len(loans) == 1 else "multiple"
+
+    for role, content in reversed(chat_history):
+        if role != "user":
+            continue
+        loans = detect_loan_types(content)
+        if len(loans) == 1:
+            return loans.pop()
+
+    return None
+
+
+CLARIFICATION_TOPICS = {
+    "interest": "interest rates",
+    "documents": "the documents required",
+    "eligibility": "eligibility",
+    "fees": "fees and charges",
+    "tenure": "the loan tenure",
+    "amount": "the loan amount",
+}
+
+_LOAN_CHOICES = ", ".join(list(LOAN_TYPES)[:-1]) + " or " + list(LOAN_TYPES)[-1]
+CLARIFICATION_TEMPLATE = (
+    "Happy to help with {subject}! Which loan are you asking about: "
+    + _LOAN_CHOICES + "?"
+)
+
+
+def clarification_for(user_question: str, loan_type: Optional[str]) -> Optional[str]:
+    """Templated "which loan type?" reply when the question is a bare
+    loan attribute and no loan type is known, else None (go to RAG)"""
+    if loan_type is not None or not _is_high_level_ambiguous(user_question):
+        return None
+
+    topics = detect_topics(user_question)
+    subject = CLARIFICATION_TOPICS[topics.pop()] if len(topics) == 1 else "that"
+    return CLARIFICATION_TEMPLATE.format(subject=subject)
+
+
+def build_retrieval_query(
     chat_history: List[Tuple[str, str]],
     user_question: str
 ) -> str:
+    """Short query used only for embedding / retrieval.
+
+    The static rules and system prompt stay out of it so the embedding
+    reflects the question. Short follow-ups ("and the documents?") are
+    condensed with the previous user message to keep the loan type; one
+    that names its own loan type ("gold loan interest rate") is used as
+    is, unless it is only a loan type answering a clarification ("gold").
+    """
+    question = user_question.strip()
+    if len(question.split()) > FOLLOW_UP_MAX_WORDS:
+        return question
+    if detect_loan_types(question) and not names_only_loan_type(question):
+        return question
+
+    # History already ends with the current question
+    previous = chat_history
+    if previous and previous[-1] == ("user", user_question):
+        previous = previous[:-1]
+
+    for role, content in reversed(previous):
+        if role == "user":
+            return f"{content.strip()} {question}"
+
+    return question
 
-    history_text = ""
-    for role, content in chat_history:
-        prefix = "User" if role == "user" else "Assistant"
-        history_text += f"{prefix}: {content}\n"
 
-    ambiguity_rules = """
+DISAMBIGUATION_RULES = """
 DISAMBIGUATION POLICY (VERY IMPORTANT):
 
 1. Ask a clarification question ONLY if:
@@ -55,7 +147,7 @@ DISAMBIGUATION POLICY (VERY IMPORTANT):
 4. NEVER block the user from getting an answer once intent is reasonably clear.
 """
 
-    answer_rules = """
+ANSWER_RULES = """
 ANSWERING RULES:
 
 - Answer strictly from provided documents.
@@ -65,20 +157,129 @@ ANSWERING RULES:
 - If an offer or variant exists, mention it briefly after answering.
 """
 
-    return f"""
-{system_prompt}
-
-Conversation history (for intent understanding only):
-{history_text}
+# Static prompt sections, rendered once
+_RULES_SECTION = f"""
 
-{ambiguity_rules}
+{DISAMBIGUATION_RULES}
 
-{answer_rules}
+{ANSWER_RULES}
 
 User Question:
-{user_question}
+"""
+
+_CLOSING_SECTION = """
 
 IMPORTANT:
 - If clarification is required, ask ONE short clarification question.
 - Otherwise, provide the answer directly.
 """
+
+
+def load_tokenizer(name: str) -> Optional[Callable[[str], List[int]]]:
+    """Encoder of the Hugging Face tokenizer `name` (no special tokens),
+    or None if it can't be loaded (offline, gated, no transformers)"""
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(name)
+    except Exception as e:
+        logger.warning(f"⚠️ Tokenizer {name} unavailable, counting with tiktoken: {e}")
+        return None
+    return partial(tokenizer.encode, add_special_tokens=False)
+
+
+def count_tokens(text: str) -> int:
+    """Token count with Settings.tokenizer: the LLM's own tokenizer once
+    the engine has set it (LLM_TOKENIZER), as for prompt packing"""
+    return len(Settings.tokenizer(text))
+
+
+@lru_cache(maxsize=8)
+def _header_section(system_prompt: str) -> Tuple[str, int]:
+    header = f"""
+{system_prompt}
+
+Conversation history (for intent understanding only):
+"""
+    return header, count_tokens(header)
+
+
+@lru_cache(maxsize=1)
+def _static_tokens() -> int:
+    return count_tokens(_RULES_SECTION) + count_tokens(_CLOSING_SECTION)
+
+
+def _fit_history(
+    chat_history: List[Tuple[str, str]],
+    token_budget: int
+) -> str:
+    """Render as many of the newest history lines as fit in token_budget"""
+    lines = []
+    used = 0
+
+    for role, content in reversed(chat_history):
+        prefix = "User" if role == "user" else "Assistant"
+        line = f"{prefix}: {content}\n"
+        tokens = count_tokens(line)
+        if used + tokens > token_budget:
+            break
+        lines.append(line)
+        used += tokens
+
+    return "".join(reversed(lines))
+
+
+def history_digest(
+    chat_history: List[Tuple[str, str]],
+    user_question: str,
+    summary: Optional[str] = None
+) -> str:
+    """Stable hash of the conversation before the current question.
+
+    Used in answer cache keys: the same question after the same prior
+    history (usually none) gets the same answer.
+    """
+    previous = chat_history
+    if previous and previous[-1] == ("user", user_question):
+        previous = previous[:-1]
+
+    if not previous and not summary:
+        return ""
+
+    h = hashlib.sha1()
+    h.update((summary or "").encode("utf-8"))
+    for role, content in previous:
+        h.update(f"\x00{role}\x00{content}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def build_prompt(
+    system_prompt: str,
+    chat_history: List[Tuple[str, str]],
+    user_question: str,
+    token_limit: int = MEMORY_TOKEN_LIMIT,
+    summary: Optional[str] = None
+) -> str:
+    """Synthesis prompt bounded to token_limit tokens.
+
+    Static sections are rendered once; history is trimmed oldest-first to
+    whatever budget is left after them, the question and the optional
+    summary of earlier turns.
+    """
+    header, header_tokens = _header_section(system_prompt)
+
+    summary_text = f"Summary of earlier conversation: {summary}\n" if summary else ""
+
+    history_budget = (
+        token_limit
+        - header_tokens
+        - _static_tokens()
+        - count_tokens(user_question)
+        - (count_tokens(summary_text) if summary_text else 0)
+    )
+    history_text = _fit_history(chat_history, max(history_budget, 0))
+
+    return (
+        f"{header}{summary_text}{history_text}"
+        f"{_RULES_SECTION}{user_question}"
+        f"{_CLOSING_SECTION}"
+    )
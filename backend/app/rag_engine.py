@@ -6,31 +6,134 @@ from llama_index.core import (
     StorageContext,
     load_index_from_storage,
     Settings,
-    Document,
-    PromptTemplate
+    PromptTemplate,
+    QueryBundle
+)
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core.schema import MetadataMode
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    VectorStoreQueryMode
 )
 from llama_index.llms.groq import Groq
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.embeddings.huggingface.utils import format_query
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
+import asyncio
 import logging
+import threading
+import uuid
 
 from config import (
     GROQ_API_KEY,
     GROQ_MODEL,
+    LLM_TOKENIZER,
     TEMPERATURE,
     EMBEDDING_MODEL,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
+    VECTOR_STORE_DTYPE,
+    VECTOR_STORE_SETTINGS,
+    ROUTE_BY_LOAN_TYPE,
+    SIMILARITY_TOP_K,
+    HYBRID_RETRIEVAL,
+    HYBRID_CANDIDATES,
+    USE_INDEX_SNAPSHOT,
     DOCUMENTS_DIR,
+    DOCUMENTS_MANIFEST,
     STORAGE_DIR,
+    SNAPSHOT_DIR,
     SYSTEM_PROMPT,
-    MAX_TOKENS
+    MAX_TOKENS,
+    CONTEXT_TOKEN_LIMIT,
+    CONTEXT_COMPRESSION,
+    COMPRESSION_THRESHOLD,
+    COMPRESSION_DEDUPE_THRESHOLD,
+    COMPRESSION_MIN_SENTENCES,
+    COMPRESSED_CONTEXT_TOKENS,
+    COMPRESSION_CACHE_SIZE,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    EMBED_BATCHING,
+    EMBED_BATCH_WINDOW_MS,
+    EMBED_BATCH_MAX
+)
+from cache import TTLCache, SemanticCache, EmbeddingCache, normalize_text
+from vector_store import NumpyVectorStore
+from snapshot import SnapshotVectorStore, snapshot_is_fresh, write_snapshot
+from ingestion import (
+    index_lock,
+    load_manifest,
+    save_manifest,
+    scan_documents,
+    sync_index
 )
+from section_parser import GENERAL_LOAN_TYPE, SectionNodeParser, node_token_count
+from prompt_builder import load_tokenizer
+from context_compressor import ContextCompressor
+from embedding_batcher import QueryEmbeddingBatcher
+
+ERROR_RESPONSE = "I encountered an error. Please contact customer care."
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class ContextBudgetPostprocessor(BaseNodePostprocessor):
+    """Keep the best-scoring retrieved nodes that fit in token_limit"""
+
+    token_limit: int = CONTEXT_TOKEN_LIMIT
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextBudgetPostprocessor"
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        ranked = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)
+
+        kept = []
+        used = 0
+        for node in ranked:
+            tokens = node_token_count(node.node)
+            # Always keep the top hit, even if it alone exceeds the budget
+            if kept and used + tokens > self.token_limit:
+                continue
+            kept.append(node)
+            used += tokens
+
+        return kept
+
+
+class HybridIndexRetriever(VectorIndexRetriever):
+    """Vector retriever whose keyword (BM25) side scores the retrieval
+    query rather than the full synthesis prompt"""
+
+    def _build_vector_store_query(self, query_bundle_with_embeddings):
+        query = super()._build_vector_store_query(query_bundle_with_embeddings)
+        query.query_str = query_bundle_with_embeddings.embedding_strs[0]
+        return query
+
+
+@dataclass(frozen=True)
+class IndexState:
+    """What a request reads from the index, swapped in as one object so a
+    request started before a reload finishes on the index it began with"""
+    index: Any
+    query_engine: Any
+    version: str
+    # Loan type -> query engine over that loan's sections + general ones
+    routes: dict
+
+
 class LoraRAGEngine:
 
     def __init__(self):
@@ -40,73 +143,184 @@ class LoraRAGEngine:
             model=GROQ_MODEL,
             api_key=GROQ_API_KEY,
             temperature=TEMPERATURE,
-            max_tokens=150  # Limit response length
+            max_tokens=MAX_TOKENS  # Limit response length
         )
 
         self.embed_model = HuggingFaceEmbedding(
-            model_name=EMBEDDING_MODEL
+            model_name=EMBEDDING_MODEL,
+            embed_batch_size=EMBED_BATCH_MAX
+        )
+        # Repeated queries skip the encoder; the rest share forward passes
+        self.embedding_cache = EmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE)
+        self.query_embedder = QueryEmbeddingBatcher(
+            self._embed_queries, EMBED_BATCH_WINDOW_MS, EMBED_BATCH_MAX
         )
 
         Settings.llm = self.llm
         Settings.embed_model = self.embed_model
-        Settings.chunk_size = CHUNK_SIZE
-        Settings.chunk_overlap = CHUNK_OVERLAP
+        # Budgets, token counts and chunking use the model's tokenizer; set
+        # before the node parser, which keeps the one current at creation
+        tokenizer = load_tokenizer(LLM_TOKENIZER)
+        if tokenizer is not None:
+            Settings.tokenizer = tokenizer
+        # Chunks follow the document's numbered sections
+        Settings.node_parser = SectionNodeParser(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
+        )
+
+        # Shared by every route, so they share its sentence embedding cache
+        self.context_compressor = ContextCompressor(
+            embed_model=self.embed_model,
+            threshold=COMPRESSION_THRESHOLD,
+            dedupe_threshold=COMPRESSION_DEDUPE_THRESHOLD,
+            min_sentences=COMPRESSION_MIN_SENTENCES,
+            token_limit=COMPRESSED_CONTEXT_TOKENS,
+            cache_size=COMPRESSION_CACHE_SIZE
+        )
+
+        self.state = None
+        # File name -> content hash of the documents in the index
+        self.indexed_files = {}
+        self._refresh_lock = threading.Lock()
 
-        self.index = None
-        self.query_engine = None
-        self.indexed_files = set()
+        # Answers keyed on (normalized question, history digest, index version)
+        self.answer_cache = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+        # Paraphrases of history-independent questions, by query embedding
+        self.semantic_cache = SemanticCache(
+            SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD
+        )
 
         self._initialize_index()
 
     def _initialize_index(self):
+        index = self._load_snapshot_index()
+        if index is None:
+            with index_lock(STORAGE_DIR):
+                # Another worker may have synced while this one waited
+                index = self._load_snapshot_index()
+                if index is None:
+                    index = self._load_storage_index()
+                    self._sync_documents(index)
+                    self._write_snapshot(index)
+        self._activate(index)
+
+    def _load_snapshot_index(self):
+        """Index over the snapshot if it is current for DOCUMENTS_DIR, else
+        None. Sets indexed_files from the manifest on disk."""
+        current = scan_documents(DOCUMENTS_DIR)
+        self.indexed_files = load_manifest(DOCUMENTS_MANIFEST)
+
         try:
-            if (STORAGE_DIR / "docstore.json").exists():
-                storage_context = StorageContext.from_defaults(
-                    persist_dir=str(STORAGE_DIR)
+            if USE_INDEX_SNAPSHOT and current == self.indexed_files \
+                    and snapshot_is_fresh(SNAPSHOT_DIR, STORAGE_DIR):
+                # Fast path: mmap the snapshot, no JSON parsing
+                return VectorStoreIndex.from_vector_store(
+                    SnapshotVectorStore.from_snapshot_dir(
+                        SNAPSHOT_DIR, **VECTOR_STORE_SETTINGS
+                    )
                 )
-                self.index = load_index_from_storage(storage_context)
-                self._update_indexed_files()
-            else:
-                self._create_new_index()
-        except Exception:
-            self._create_new_index()
+        except Exception as e:
+            logger.warning(f"Index snapshot unusable, loading storage: {e}")
+        return None
 
-        self._create_query_engine()
+    @property
+    def index(self):
+        return self.state.index
 
-    def _load_txt_files(self):
-        documents = []
+    @property
+    def query_engine(self):
+        return self.state.query_engine
 
-        for txt_file in DOCUMENTS_DIR.glob("*.txt"):
-            with open(txt_file, "r", encoding="utf-8") as f:
-                text = f.read().strip()
+    @property
+    def index_version(self):
+        return self.state.version if self.state else None
 
-            if text:
-                documents.append(
-                    Document(
-                        text=text,
-                        metadata={"file_name": txt_file.name}
+    def _load_storage_index(self):
+        """Writable index from the JSON storage (empty if there is none)"""
+        try:
+            if (STORAGE_DIR / "docstore.json").exists():
+                storage_context = StorageContext.from_defaults(
+                    persist_dir=str(STORAGE_DIR),
+                    vector_store=NumpyVectorStore.from_persist_dir(
+                        str(STORAGE_DIR),
+                        dtype=VECTOR_STORE_DTYPE,
+                        **VECTOR_STORE_SETTINGS
                     )
                 )
+                return load_index_from_storage(storage_context)
+        except Exception as e:
+            logger.warning(f"Stored index unusable, rebuilding: {e}")
+            # Nothing in it can be trusted to match the manifest
+            self.indexed_files = {}
+
+        storage_context = StorageContext.from_defaults(
+            vector_store=NumpyVectorStore(
+                dtype=VECTOR_STORE_DTYPE, **VECTOR_STORE_SETTINGS
+            )
+        )
+        return VectorStoreIndex([], storage_context=storage_context)
 
-        return documents
+    def _sync_documents(self, index) -> bool:
+        """Embed new/changed files, drop removed ones and persist.
+        Returns whether the index changed."""
+        current, inserted, deleted = sync_index(
+            index, DOCUMENTS_DIR, self.indexed_files
+        )
+        changed = bool(inserted or deleted)
 
-    def _create_new_index(self):
-        docs = self._load_txt_files()
+        if changed or not (STORAGE_DIR / "docstore.json").exists():
+            index.storage_context.persist(persist_dir=str(STORAGE_DIR))
+        if changed or current != self.indexed_files:
+            save_manifest(DOCUMENTS_MANIFEST, current)
 
-        if docs:
-            self.index = VectorStoreIndex.from_documents(docs)
-        else:
-            self.index = VectorStoreIndex([])
+        self.indexed_files = current
+        return changed
 
-        self.index.storage_context.persist(
-            persist_dir=str(STORAGE_DIR)
-        )
-        self._update_indexed_files()
+    def refresh_documents(self) -> bool:
+        """Re-index whatever changed in DOCUMENTS_DIR since the last sync.
+        Returns whether the index changed."""
+        with self._refresh_lock:
+            if scan_documents(DOCUMENTS_DIR) == self.indexed_files:
+                return False
+            live_files = self.indexed_files
 
-    def _update_indexed_files(self):
-        self.indexed_files = set(f.name for f in DOCUMENTS_DIR.glob("*.txt"))
+            with index_lock(STORAGE_DIR):
+                # Another worker may already have synced this change
+                index = self._load_snapshot_index()
+                if index is None:
+                    # Work on a writable copy; the live index keeps serving
+                    index = self._load_storage_index()
+                    self._sync_documents(index)
+                    self._write_snapshot(index)
 
-    def _create_query_engine(self):
+            if self.indexed_files == live_files:
+                return False
+
+            self._activate(index)
+            logger.info("🔄 Index refreshed from documents")
+            return True
+
+    def _write_snapshot(self, index):
+        if not USE_INDEX_SNAPSHOT:
+            return
+        try:
+            write_snapshot(
+                index.vector_store,
+                index.docstore,
+                SNAPSHOT_DIR,
+                STORAGE_DIR
+            )
+        except Exception as e:
+            logger.warning(f"Could not write index snapshot: {e}")
+
+    def _node_postprocessors(self) -> list:
+        postprocessors = [ContextBudgetPostprocessor()]
+        if CONTEXT_COMPRESSION:
+            postprocessors.append(self.context_compressor)
+        return postprocessors
+
+    def _create_query_engine(self, index, filters=None):
         # Custom concise prompt template
         qa_prompt = PromptTemplate(
             "Context:\n{context_str}\n\n"
@@ -114,31 +328,303 @@ class LoraRAGEngine:
             "Instructions: Answer in 2-3 sentences maximum. Be direct and concise.\n"
             "Answer:"
         )
+        self.qa_prompt = qa_prompt
         
-        self.query_engine = self.index.as_query_engine(
-            similarity_top_k=3,
-            response_mode="compact"
+        # Built directly rather than with as_query_engine(): that passes
+        # every node id as a restriction, which forces the vector store off
+        # its vectorized path (and matches nothing for a snapshot index)
+        retriever = HybridIndexRetriever(
+            index=index,
+            similarity_top_k=SIMILARITY_TOP_K,
+            filters=filters,
+            vector_store_query_mode=(
+                VectorStoreQueryMode.HYBRID if HYBRID_RETRIEVAL
+                else VectorStoreQueryMode.DEFAULT
+            ),
+            sparse_top_k=HYBRID_CANDIDATES
+        )
+        # query()/aquery()/astream() only retrieve through it and build the
+        # prompt themselves (_build_qa_prompt); compact mode remains for
+        # direct query_engine.query() callers
+        query_engine = RetrieverQueryEngine.from_args(
+            retriever,
+            response_mode="compact",
+            node_postprocessors=self._node_postprocessors()
         )
         
         # Update prompts
-        self.query_engine.update_prompts(
+        query_engine.update_prompts(
             {"response_synthesizer:text_qa_template": qa_prompt}
         )
+        return query_engine
+
+    def _create_routes(self, index) -> dict:
+        routes = {}
+        if not ROUTE_BY_LOAN_TYPE:
+            return routes
+
+        for loan_type in index.vector_store.partition_values():
+            if loan_type in (None, GENERAL_LOAN_TYPE):
+                continue
+            routes[loan_type] = self._create_query_engine(
+                index,
+                MetadataFilters(filters=[
+                    MetadataFilter(
+                        key="loan_type",
+                        value=[loan_type, GENERAL_LOAN_TYPE],
+                        operator=FilterOperator.IN
+                    )
+                ])
+            )
+        return routes
+
+    def _activate(self, index):
+        """Build everything for index, then swap it in with one assignment"""
+        # No-op in exact mode; otherwise makes sure the IVF index is current
+        if index.vector_store.ensure_ann():
+            logger.info("🧭 Approximate (IVF) retrieval enabled")
+        if HYBRID_RETRIEVAL:
+            index.vector_store.ensure_bm25()
+
+        self.state = IndexState(
+            index=index,
+            query_engine=self._create_query_engine(index),
+            version=uuid.uuid4().hex,
+            routes=self._create_routes(index)
+        )
+
+        # New index contents: cached answers are stale (entries are keyed
+        # on the version, clearing just frees the memory)
+        self.answer_cache.clear()
+        self.semantic_cache.clear()
+
+    def _answer_cache_key(self, question: str, history_key: str, version: str):
+        if question is None:
+            return None
+        return (normalize_text(question), history_key, version)
+
+    def _cached_answer(self, cache_key, history_key: str, embedding=None,
+                       loan_type: str = None):
+        """Exact lookup, or semantic lookup once the embedding is known"""
+        if cache_key is None:
+            return None
+
+        if embedding is None:
+            return self.answer_cache.get(cache_key)
+
+        # Paraphrase matching only makes sense without prior history
+        if history_key:
+            return None
+        answer = self.semantic_cache.get(embedding, cache_key[2], loan_type)
+        if answer is not None:
+            self.answer_cache.set(cache_key, answer)
+        return answer
+
+    def _remember_answer(self, cache_key, history_key: str, embedding, answer: str,
+                         loan_type: str = None):
+        if cache_key is None:
+            return
+        self.answer_cache.set(cache_key, answer)
+        if not history_key and embedding is not None:
+            self.semantic_cache.set(embedding, answer, cache_key[2], loan_type)
+
+    def cache_stats(self) -> dict:
+        return {
+            "index_version": self.index_version,
+            "answer_cache": self.answer_cache.stats(),
+            "semantic_cache": self.semantic_cache.stats(),
+            "embedding_cache": self.embedding_cache.stats(),
+            "query_embedder": self.query_embedder.stats()
+        }
+
+    def _query_bundle(self, full_prompt: str, retrieval_query: str = None,
+                      embedding=None) -> QueryBundle:
+        """Synthesis uses full_prompt, retrieval embeds only retrieval_query"""
+        return QueryBundle(
+            query_str=full_prompt,
+            custom_embedding_strs=[retrieval_query or full_prompt],
+            embedding=embedding
+        )
+
+    def _embed_queries(self, texts: list) -> list:
+        """get_query_embedding for several queries in one forward pass.
+        The query instruction is added here; bge has no text instruction,
+        so the text batch path then embeds exactly the query strings."""
+        return self.embed_model.get_text_embedding_batch([
+            format_query(text, self.embed_model.model_name,
+                         self.embed_model.query_instruction)
+            for text in texts
+        ])
+
+    def _embed_query(self, text: str):
+        embedding = self.embedding_cache.get(text)
+        if embedding is None:
+            if EMBED_BATCHING:
+                embedding = self.query_embedder.embed(text)
+            else:
+                embedding = self.embed_model.get_query_embedding(text)
+            self.embedding_cache.set(text, embedding)
+        return embedding
+
+    async def _aembed_query(self, text: str):
+        embedding = self.embedding_cache.get(text)
+        if embedding is None:
+            if EMBED_BATCHING:
+                embedding = await self.query_embedder.aembed(text)
+            else:
+                # The local embedding model is CPU-bound, run it in a worker thread
+                embedding = await asyncio.to_thread(
+                    self.embed_model.get_query_embedding, text
+                )
+            self.embedding_cache.set(text, embedding)
+        return embedding
+
+    def query(self, full_prompt: str, retrieval_query: str = None,
+              question: str = None, history_key: str = "",
+              loan_type: str = None) -> dict:
+        """Answer full_prompt. Passing the raw question (and a digest of the
+        prior history) enables the answer caches; a loan_type limits
+        retrieval to that loan's sub-index."""
+        state = self.state
+        query_engine = state.routes.get(loan_type, state.query_engine)
+        cache_key = self._answer_cache_key(question, history_key, state.version)
+        cached = self._cached_answer(cache_key, history_key)
+        if cached is not None:
+            return {"response": cached, "sources": []}
 
-    def query(self, full_prompt: str) -> dict:
         try:
-            response = self.query_engine.query(full_prompt)
+            retrieval_query = retrieval_query or full_prompt
+            embedding = self._embed_query(retrieval_query)
+
+            cached = self._cached_answer(cache_key, history_key, embedding, loan_type)
+            if cached is not None:
+                return {"response": cached, "sources": []}
+
+            nodes = query_engine.retrieve(
+                self._query_bundle(full_prompt, retrieval_query, embedding)
+            )
+            answer = self.llm.complete(
+                self._build_qa_prompt(full_prompt, nodes)
+            ).text
+            self._remember_answer(cache_key, history_key, embedding, answer, loan_type)
 
             # Don't include sources in the response
             return {
-                "response": str(response),
+                "response": answer,
+                "sources": []
+            }
+
+        except Exception as e:
+            logger.error(f"Query error: {e}")
+            return {
+                "response": ERROR_RESPONSE,
+                "sources": []
+            }
+
+    async def _aretrieve(self, query_engine, query_bundle):
+        # aretrieve() runs the node postprocessors synchronously, and the
+        # context compressor may embed uncached sentences: keep both off
+        # the event loop
+        return await asyncio.to_thread(query_engine.retrieve, query_bundle)
+
+    def _build_qa_prompt(self, query_str: str, nodes) -> str:
+        """QA prompt over the retrieved nodes as they are: the node
+        postprocessors already keep them within the context budget, so
+        compact mode's re-tokenizing repack is skipped"""
+        context_str = "\n\n".join(
+            n.node.get_content(metadata_mode=MetadataMode.LLM) for n in nodes
+        )
+        return self.qa_prompt.format(
+            context_str=context_str,
+            query_str=query_str
+        )
+
+    async def astream(self, full_prompt: str, retrieval_query: str = None,
+                      question: str = None, history_key: str = "",
+                      loan_type: str = None):
+        """Stream the answer as text deltas (async generator).
+
+        Retrieval is the same as query(); synthesis streams straight from
+        the LLM with the same QA template so the first token arrives as
+        soon as Groq produces it. A cached answer is sent as one delta.
+        """
+        state = self.state
+        query_engine = state.routes.get(loan_type, state.query_engine)
+        cache_key = self._answer_cache_key(question, history_key, state.version)
+        cached = self._cached_answer(cache_key, history_key)
+        if cached is not None:
+            yield cached
+            return
+
+        try:
+            retrieval_query = retrieval_query or full_prompt
+            embedding = await self._aembed_query(retrieval_query)
+
+            cached = self._cached_answer(cache_key, history_key, embedding, loan_type)
+            if cached is not None:
+                yield cached
+                return
+
+            nodes = await self._aretrieve(
+                query_engine, self._query_bundle(full_prompt, retrieval_query, embedding)
+            )
+
+            stream = await self.llm.astream_complete(
+                self._build_qa_prompt(full_prompt, nodes)
+            )
+            parts = []
+            async for chunk in stream:
+                if chunk.delta:
+                    parts.append(chunk.delta)
+                    yield chunk.delta
+
+            self._remember_answer(
+                cache_key, history_key, embedding, "".join(parts), loan_type
+            )
+
+        except Exception as e:
+            logger.error(f"Stream error: {e}")
+            yield ERROR_RESPONSE
+
+    async def aquery(self, full_prompt: str, retrieval_query: str = None,
+                     question: str = None, history_key: str = "",
+                     loan_type: str = None) -> dict:
+        """Async version of query() for use from the event loop"""
+        state = self.state
+        query_engine = state.routes.get(loan_type, state.query_engine)
+        cache_key = self._answer_cache_key(question, history_key, state.version)
+        cached = self._cached_answer(cache_key, history_key)
+        if cached is not None:
+            return {"response": cached, "sources": []}
+
+        try:
+            # Embedding is batched off the loop, retrieval runs in a worker
+            # thread and the Groq call is awaited natively
+            retrieval_query = retrieval_query or full_prompt
+            embedding = await self._aembed_query(retrieval_query)
+
+            cached = self._cached_answer(cache_key, history_key, embedding, loan_type)
+            if cached is not None:
+                return {"response": cached, "sources": []}
+
+            nodes = await self._aretrieve(
+                query_engine, self._query_bundle(full_prompt, retrieval_query, embedding)
+            )
+            response = await self.llm.acomplete(
+                self._build_qa_prompt(full_prompt, nodes)
+            )
+            answer = response.text
+            self._remember_answer(cache_key, history_key, embedding, answer, loan_type)
+
+            return {
+                "response": answer,
                 "sources": []
             }
 
         except Exception as e:
             logger.error(f"Query error: {e}")
             return {
-                "response": "I encountered an error. Please contact customer care.",
+                "response": ERROR_RESPONSE,
                 "sources": []
             }
 
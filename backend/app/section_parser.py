@@ -0,0 +1,129 @@
+# Path: backend/section_parser.py
+# Purpose: Structure-aware chunking for the numbered finance documents
+# Design:
+# - "2. GOLD LOAN SERVICES" (underlined with ====) starts a section,
+#   "2.3 GOLD LOAN INTEREST RATES (2026)" a sub-section
+# - One node per sub-section; only sub-sections longer than chunk_size
+#   are split further (sentence-wise)
+# - section_path ("2. GOLD LOAN SERVICES > 2.3 ...") goes into the
+#   embedded and prompt text; loan_type comes from the most specific
+#   heading that names one product, "general" if none does
+# - token_count (LLM-mode text, the tokenizer prompt packing uses) is
+#   computed once here, so budgeting never re-tokenizes a static chunk
+
+import re
+from typing import Any, List, Sequence, Tuple
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode, MetadataMode
+
+from knowledge_box import detect_loan_types
+from prompt_builder import count_tokens
+
+GENERAL_LOAN_TYPE = "general"
+PATH_SEPARATOR = " > "
+TOKEN_COUNT_KEY = "token_count"
+
+# Numbered lists in the body are not underlined / not upper case
+_SECTION_HEADING = re.compile(r"^\d+\.\s+\S.*\n=+$", re.M)
+_SUBSECTION_HEADING = re.compile(r"^\d+\.\d+\s+[^a-z\n]+$", re.M)
+
+# Metadata used for routing only, kept out of embedded / prompt text
+_HIDDEN_KEYS = ["file_name", "section", "loan_type", TOKEN_COUNT_KEY]
+
+
+def _split_at(pattern: re.Pattern, text: str) -> List[Tuple[str, str]]:
+    """(heading, text) per match of pattern; text before the first
+    heading gets an empty heading"""
+    starts = [m.start() for m in pattern.finditer(text)]
+    bounds = [0] + starts + [len(text)]
+
+    parts = []
+    for start, end in zip(bounds, bounds[1:]):
+        body = text[start:end].strip().strip("=").strip()
+        if body:
+            heading = body.splitlines()[0].strip() if start in starts else ""
+            parts.append((heading, body))
+    return parts
+
+
+def split_sections(text: str) -> List[Tuple[str, str]]:
+    return _split_at(_SECTION_HEADING, text)
+
+
+def split_subsections(text: str) -> List[Tuple[str, str]]:
+    return _split_at(_SUBSECTION_HEADING, text)
+
+
+def node_token_count(node: BaseNode) -> int:
+    """Tokens of the node's LLM-mode text, stored at ingestion; counted
+    here for nodes indexed before token counts were stored"""
+    tokens = node.metadata.get(TOKEN_COUNT_KEY)
+    if tokens is None:
+        tokens = count_tokens(node.get_content(metadata_mode=MetadataMode.LLM))
+    return tokens
+
+
+def headings_loan_type(*headings: str) -> str:
+    """Loan type of the most specific heading that names exactly one"""
+    for heading in reversed(headings):
+        loans = detect_loan_types(heading)
+        if len(loans) == 1:
+            return loans.pop()
+    return GENERAL_LOAN_TYPE
+
+
+class SectionNodeParser(NodeParser):
+    """Chunk on section / sub-section boundaries, carrying the path"""
+
+    chunk_size: int = Field(default=512, description="Max tokens per chunk")
+    chunk_overlap: int = Field(default=50, description="Overlap when a sub-section is split")
+
+    _splitter: Any = PrivateAttr()
+
+    def __init__(self, chunk_size: int = 512, chunk_overlap: int = 50, **kwargs: Any):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self._splitter = SentenceSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SectionNodeParser"
+
+    def _units(self, text: str) -> List[Tuple[str, str, str]]:
+        """(section heading, section path, text) per sub-section"""
+        units = []
+        for section, section_text in split_sections(text):
+            for subsection, body in split_subsections(section_text):
+                if body == (subsection or section):
+                    continue  # heading with nothing under it
+                path = PATH_SEPARATOR.join(h for h in (section, subsection) if h)
+                units.append((section, path, body))
+        return units
+
+    def _parse_nodes(self, nodes: Sequence[BaseNode], show_progress: bool = False,
+                     **kwargs: Any) -> List[BaseNode]:
+        all_nodes = []
+        for document in nodes:
+            for section, path, body in self._units(document.get_content()):
+                loan_type = headings_loan_type(*path.split(PATH_SEPARATOR))
+                path_line = f"section_path: {path}"
+                splits = self._splitter.split_text_metadata_aware(body, path_line)
+
+                for node in build_nodes_from_splits(splits, document, id_func=self.id_func):
+                    node.metadata = {
+                        **document.metadata,
+                        "section": section,
+                        "section_path": path,
+                        "loan_type": loan_type
+                    }
+                    node.excluded_embed_metadata_keys = list(_HIDDEN_KEYS)
+                    node.excluded_llm_metadata_keys = list(_HIDDEN_KEYS)
+                    node.metadata[TOKEN_COUNT_KEY] = count_tokens(
+                        node.get_content(metadata_mode=MetadataMode.LLM)
+                    )
+                    all_nodes.append(node)
+        return all_nodes
@@ -1,21 +1,441 @@
 # Path: backend/session_store.py
 # Purpose: SQLite-based session & chat history storage
 
+import atexit
+import logging
+import os
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
 
 DB_PATH = Path(__file__).resolve().parent.parent / "storage" / "chat_sessions.db"
 
-
-def init_db():
-    DB_PATH.parent.mkdir(exist_ok=True)
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
+# Connection pool settings
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 64
+
+# In-memory history cache settings
+HISTORY_CACHE_SESSIONS = 1024   # max sessions kept in memory (LRU)
+HISTORY_CACHE_DEPTH = 20        # messages kept per cached session
+
+# Durability of message writes:
+# - "batched": write-behind, inserts are flushed in batches every
+#   FLUSH_INTERVAL_MS (a crash can lose the last few milliseconds)
+# - "sync": every insert is committed before returning
+HISTORY_DURABILITY = os.getenv("HISTORY_DURABILITY", "batched")
+FLUSH_INTERVAL_MS = 5
+FLUSH_MAX_BATCH = 500
+
+# Retention settings
+RETENTION_DAYS = 30             # purge sessions idle for longer than this
+RETENTION_INTERVAL_S = 3600     # how often the retention job runs
+RETENTION_ARCHIVE = False       # copy purged sessions to ARCHIVE_DB_PATH first
+ARCHIVE_DB_PATH = DB_PATH.with_name("chat_sessions_archive.db")
+VACUUM_MAX_PAGES = 2000         # pages released per incremental vacuum
+
+logger = logging.getLogger(__name__)
+
+# SQL statements are module constants so every pooled connection reuses
+# the same prepared statement from its statement cache.
+SQL_CREATE_SESSION = """
+INSERT OR IGNORE INTO sessions (session_id, created_at, is_active)
+VALUES (?, ?, 1)
+"""
+SQL_INSERT_MESSAGE = """
+INSERT INTO messages (session_id, role, content, created_at)
+VALUES (?, ?, ?, ?)
+"""
+SQL_SESSION_STATUS = """
+SELECT is_active, generation FROM sessions WHERE session_id = ?
+"""
+SQL_BUMP_GENERATION = """
+UPDATE sessions SET generation = generation + 1 WHERE session_id = ?
+"""
+SQL_RECENT_MESSAGES = """
+SELECT role, content
+FROM messages
+WHERE session_id = ?
+ORDER BY id DESC
+LIMIT ?
+"""
+SQL_DELETE_MESSAGES = """
+DELETE FROM messages WHERE session_id = ?
+"""
+SQL_DEACTIVATE_SESSION = """
+UPDATE sessions SET is_active = 0, generation = generation + 1 WHERE session_id = ?
+"""
+SQL_ACTIVATE_SESSION = """
+UPDATE sessions SET is_active = 1, generation = generation + 1 WHERE session_id = ?
+"""
+SQL_EXPIRED_SESSIONS = """
+SELECT s.session_id
+FROM sessions s
+WHERE s.is_active = 0
+   OR COALESCE(
+        (SELECT m.created_at FROM messages m
+         WHERE m.session_id = s.session_id
+         ORDER BY m.id DESC LIMIT 1),
+        s.created_at
+      ) < ?
+"""
+SQL_DELETE_SESSION = """
+DELETE FROM sessions WHERE session_id = ?
+"""
+SQL_ARCHIVE_MESSAGES = """
+INSERT INTO archive.messages (session_id, role, content, created_at)
+SELECT session_id, role, content, created_at
+FROM messages WHERE session_id = ? ORDER BY id
+"""
+SQL_ARCHIVE_SESSION = """
+INSERT OR REPLACE INTO archive.sessions (session_id, created_at, archived_at)
+SELECT session_id, created_at, ? FROM sessions WHERE session_id = ?
+"""
+SQL_MESSAGES_AFTER = """
+SELECT id, role, content
+FROM messages
+WHERE session_id = ? AND id > ?
+ORDER BY id
+"""
+SQL_GET_SUMMARY = """
+SELECT summary, last_message_id FROM session_summaries WHERE session_id = ?
+"""
+SQL_SAVE_SUMMARY = """
+INSERT INTO session_summaries (session_id, summary, last_message_id, updated_at)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(session_id) DO UPDATE SET
+    summary = excluded.summary,
+    last_message_id = excluded.last_message_id,
+    updated_at = excluded.updated_at
+"""
+SQL_DELETE_SUMMARY = """
+DELETE FROM session_summaries WHERE session_id = ?
+"""
+SQL_UPSERT_ACTIVE_SESSION = """
+INSERT INTO sessions (session_id, created_at, is_active)
+VALUES (?, ?, 1)
+ON CONFLICT(session_id) DO UPDATE SET
+    is_active = 1,
+    generation = generation + 1
+"""
+
+
+class _ConnectionPool:
+    """Thread-safe pool of WAL-mode SQLite connections"""
+
+    def __init__(self, db_path: Path, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._pool = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode and
+        # only fsyncs on checkpoint instead of on every commit.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool exhausted - wait for a connection to be released
+        return self._pool.get()
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._pool.put(conn)
+
+    def discard(self, conn: sqlite3.Connection):
+        """Drop a broken connection so the pool can open a fresh one"""
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> _ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _ConnectionPool(DB_PATH)
+    return _pool
+
+
+@contextmanager
+def _connection(immediate: bool = False):
+    """Borrow a pooled connection, committing on success.
+
+    With immediate=True the write lock is taken up front (BEGIN IMMEDIATE)
+    so the whole block runs as one serialized transaction.
+    """
+    pool = _get_pool()
+    conn = pool.acquire()
+    try:
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pool.discard(conn)
+        else:
+            pool.release(conn)
+        raise
+    else:
+        pool.release(conn)
+
+
+class _HistoryCache:
+    """LRU cache of the most recent messages per active session.
+
+    Several workers share the database, so each entry remembers the
+    session's generation: a counter bumped in the same transaction as
+    every write to the session, by any worker. Reads pass the generation
+    they just saw in the database and an entry that doesn't match it is
+    dropped (cleared, reactivated or purged elsewhere, or a turn handled
+    by another worker).
+    """
+
+    def __init__(self, max_sessions: int, depth: int):
+        self.max_sessions = max_sessions
+        self.depth = depth
+        self._entries = OrderedDict()
+        self._generations = {}
+        self.lock = threading.RLock()
+
+    def is_current(self, session_id: str, generation) -> bool:
+        """Whether the entry matches the database's generation (None: no
+        active session row); a stale entry is dropped"""
+        with self.lock:
+            if session_id not in self._entries:
+                return False
+            if generation is None or self._generations[session_id] != generation:
+                self.invalidate(session_id)
+                return False
+            return True
+
+    def get(self, session_id: str, limit: int, generation):
+        with self.lock:
+            if not self.is_current(session_id, generation) or limit > self.depth:
+                return None
+            self._entries.move_to_end(session_id)
+            return list(self._entries[session_id])[-limit:] if limit > 0 else []
+
+    def load(self, session_id: str, rows, generation: int):
+        with self.lock:
+            self._entries[session_id] = deque(rows, maxlen=self.depth)
+            self._generations[session_id] = generation
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                evicted, _ = self._entries.popitem(last=False)
+                self._generations.pop(evicted, None)
+
+    def append(self, session_id: str, role: str, content: str) -> bool:
+        with self.lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return False
+            entry.append((role, content))
+            self._entries.move_to_end(session_id)
+            return True
+
+    def advance(self, session_id: str, generation):
+        """Record a write this process made as generation; the entry
+        survives only if it was current just before that write"""
+        with self.lock:
+            if generation is not None and self.is_current(session_id, generation - 1):
+                self._generations[session_id] = generation
+            else:
+                self.invalidate(session_id)
+
+    def contains(self, session_id: str) -> bool:
+        with self.lock:
+            return session_id in self._entries
+
+    def invalidate(self, session_id: str):
+        with self.lock:
+            self._entries.pop(session_id, None)
+            self._generations.pop(session_id, None)
+
+
+class _WriteBehindQueue:
+    """Background flusher batching message inserts into one transaction"""
+
+    def __init__(self, interval_ms: int, max_batch: int):
+        self.interval = interval_ms / 1000
+        self.max_batch = max_batch
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def put(self, row: tuple):
+        with self._cond:
+            self._pending.append(row)
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(
+                    target=self._run, name="session-flusher", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def has_pending(self, session_id: str) -> bool:
+        with self._cond:
+            return any(row[0] == session_id for row in self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._pending:
+                    return
+
+            # Let concurrent requests join the batch
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"History flush failed: {e}")
+                time.sleep(self.interval * 10)
+
+    def flush(self):
+        """Write all pending messages, in arrival order"""
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = self._pending[:self.max_batch]
+                    del self._pending[:self.max_batch]
+                if not batch:
+                    return
+                try:
+                    with _connection() as conn:
+                        conn.executemany(SQL_INSERT_MESSAGE, batch)
+                        _advance_generations(
+                            conn, dict.fromkeys(row[0] for row in batch)
+                        )
+                except Exception:
+                    # Put the batch back so it is retried first
+                    with self._cond:
+                        self._pending[:0] = batch
+                    raise
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+        self.flush()
+
+
+_history_cache = _HistoryCache(HISTORY_CACHE_SESSIONS, HISTORY_CACHE_DEPTH)
+_write_queue = _WriteBehindQueue(FLUSH_INTERVAL_MS, FLUSH_MAX_BATCH)
+
+
+def _write_behind() -> bool:
+    return HISTORY_DURABILITY == "batched"
+
+
+def _session_generation(session_id: str):
+    """Generation of an active session, None if it is missing or inactive"""
+    with _connection() as conn:
+        row = conn.execute(SQL_SESSION_STATUS, (session_id,)).fetchone()
+    return row[1] if row and row[0] else None
+
+
+def _advance_generations(conn: sqlite3.Connection, session_ids):
+    """Bump the generation of sessions this process just wrote messages
+    to, inside the writing transaction, and keep their cache entries in
+    step"""
+    for session_id in session_ids:
+        conn.execute(SQL_BUMP_GENERATION, (session_id,))
+        row = conn.execute(SQL_SESSION_STATUS, (session_id,)).fetchone()
+        _history_cache.advance(session_id, row[1] if row and row[0] else None)
+
+
+def _flush_session(session_id: str):
+    """Make sure queued writes for a session are on disk before reading it"""
+    if _write_queue.has_pending(session_id):
+        _write_queue.flush()
+
+
+def flush_messages():
+    """Flush queued message writes to disk"""
+    _write_queue.flush()
+
+
+def close_db():
+    """Flush pending writes and close all pooled connections (call on shutdown)"""
+    global _pool
+    stop_retention_job()
+    _write_queue.stop()
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+
+# ---------------------------------------------------------------------------
+# Schema migrations
+# ---------------------------------------------------------------------------
+
+def _migrate_base_schema(conn: sqlite3.Connection):
     # Create sessions table with is_active column
-    cur.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS sessions (
         session_id TEXT PRIMARY KEY,
         created_at TEXT,
@@ -24,7 +444,7 @@ def init_db():
     """)
 
     # Create messages table
-    cur.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS messages (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         session_id TEXT,
@@ -34,103 +454,340 @@ def init_db():
     )
     """)
 
-    # Check if is_active column exists, if not add it (for existing databases)
-    cur.execute("PRAGMA table_info(sessions)")
-    columns = [column[1] for column in cur.fetchall()]
-    
+    # Databases created before is_active existed
+    columns = [column[1] for column in conn.execute("PRAGMA table_info(sessions)")]
     if 'is_active' not in columns:
-        print("⚠️ Migrating database: Adding is_active column...")
-        cur.execute("ALTER TABLE sessions ADD COLUMN is_active INTEGER DEFAULT 1")
-        print("✅ Database migration complete")
+        conn.execute("ALTER TABLE sessions ADD COLUMN is_active INTEGER DEFAULT 1")
 
-    conn.commit()
-    conn.close()
 
+def _migrate_indexes(conn: sqlite3.Connection):
+    # Serves "WHERE session_id = ? ORDER BY id DESC LIMIT ?" from the index
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_messages_session_id
+    ON messages (session_id, id)
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sessions_is_active
+    ON sessions (is_active)
+    """)
 
-def create_session_if_not_exists(session_id: str):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
 
-    cur.execute("""
-    INSERT OR IGNORE INTO sessions (session_id, created_at, is_active)
-    VALUES (?, ?, 1)
-    """, (session_id, datetime.utcnow().isoformat()))
+def _migrate_incremental_vacuum(conn: sqlite3.Connection):
+    # auto_vacuum can only be switched on an existing file by a full VACUUM
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def _migrate_session_summaries(conn: sqlite3.Connection):
+    # Rolling summary of the turns older than the prompt's history window
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS session_summaries (
+        session_id TEXT PRIMARY KEY,
+        summary TEXT,
+        last_message_id INTEGER,
+        updated_at TEXT
+    )
+    """)
+
+
+def _migrate_session_generation(conn: sqlite3.Connection):
+    # Bumped by every write to a session so each worker's history cache
+    # can tell when another worker changed it
+    conn.execute("ALTER TABLE sessions ADD COLUMN generation INTEGER DEFAULT 0")
+
+
+# (version, description, migration, runs inside a transaction)
+MIGRATIONS = [
+    (1, "base schema", _migrate_base_schema, True),
+    (2, "message and session indexes", _migrate_indexes, True),
+    (3, "incremental auto-vacuum", _migrate_incremental_vacuum, False),
+    (4, "session summaries", _migrate_session_summaries, True),
+    (5, "session generation", _migrate_session_generation, True),
+]
+
 
-    conn.commit()
-    conn.close()
+def _run_migrations(conn: sqlite3.Connection):
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for version, description, migrate, transactional in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info(f"⚠️ Migrating database to v{version}: {description}")
+        if transactional:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        else:
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+
+    if current < MIGRATIONS[-1][0]:
+        logger.info("✅ Database migration complete")
+
+
+def init_db():
+    DB_PATH.parent.mkdir(exist_ok=True)
+
+    with _connection() as conn:
+        _run_migrations(conn)
+
+
+# ---------------------------------------------------------------------------
+# Retention
+# ---------------------------------------------------------------------------
+
+def _archive_sessions(conn: sqlite3.Connection, session_ids):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive.sessions (
+        session_id TEXT PRIMARY KEY,
+        created_at TEXT,
+        archived_at TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive.messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT,
+        role TEXT,
+        content TEXT,
+        created_at TEXT
+    )
+    """)
+
+    now = datetime.utcnow().isoformat()
+    for session_id in session_ids:
+        conn.execute(SQL_ARCHIVE_SESSION, (now, session_id))
+        conn.execute(SQL_ARCHIVE_MESSAGES, (session_id,))
+
+
+def purge_expired_sessions(retention_days: int = RETENTION_DAYS) -> int:
+    """Delete inactive sessions and sessions idle for more than
+    retention_days, then release the freed pages. Returns the number of
+    sessions purged."""
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).isoformat()
+
+    # Queued writes count as activity
+    _write_queue.flush()
+
+    with _connection() as conn:
+        if RETENTION_ARCHIVE:
+            conn.execute("ATTACH DATABASE ? AS archive", (str(ARCHIVE_DB_PATH),))
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            session_ids = [
+                row[0] for row in conn.execute(SQL_EXPIRED_SESSIONS, (cutoff,))
+            ]
+
+            if session_ids:
+                if RETENTION_ARCHIVE:
+                    _archive_sessions(conn, session_ids)
+
+                params = [(session_id,) for session_id in session_ids]
+                conn.executemany(SQL_DELETE_MESSAGES, params)
+                conn.executemany(SQL_DELETE_SUMMARY, params)
+                conn.executemany(SQL_DELETE_SESSION, params)
+
+                for session_id in session_ids:
+                    _history_cache.invalidate(session_id)
+
+            conn.commit()
+        finally:
+            if RETENTION_ARCHIVE:
+                conn.execute("DETACH DATABASE archive")
+
+        if session_ids:
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_MAX_PAGES})").fetchall()
+        conn.execute("PRAGMA optimize")
+
+    if session_ids:
+        logger.info(f"🧹 Purged {len(session_ids)} expired chat sessions")
+
+    return len(session_ids)
+
+
+_retention_stop = threading.Event()
+_retention_thread = None
+
+
+def _retention_loop(interval_s: float):
+    while not _retention_stop.wait(interval_s):
+        try:
+            purge_expired_sessions()
+        except Exception as e:
+            logger.error(f"Retention job failed: {e}")
+
+
+def start_retention_job(interval_s: float = RETENTION_INTERVAL_S):
+    """Run purge_expired_sessions periodically in a background thread"""
+    global _retention_thread
+    if _retention_thread is not None and _retention_thread.is_alive():
+        return
+
+    _retention_stop.clear()
+    _retention_thread = threading.Thread(
+        target=_retention_loop,
+        args=(interval_s,),
+        name="session-retention",
+        daemon=True
+    )
+    _retention_thread.start()
+
+
+def stop_retention_job():
+    global _retention_thread
+    _retention_stop.set()
+    if _retention_thread is not None:
+        _retention_thread.join(timeout=5)
+        _retention_thread = None
+
+
+def create_session_if_not_exists(session_id: str):
+    with _connection() as conn:
+        conn.execute(
+            SQL_CREATE_SESSION,
+            (session_id, datetime.utcnow().isoformat())
+        )
 
 
 def save_message(session_id: str, role: str, content: str):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+    row = (session_id, role, content, datetime.utcnow().isoformat())
 
-    cur.execute("""
-    INSERT INTO messages (session_id, role, content, created_at)
-    VALUES (?, ?, ?, ?)
-    """, (session_id, role, content, datetime.utcnow().isoformat()))
+    with _history_cache.lock:
+        cached = _history_cache.append(session_id, role, content)
+        if cached and _write_behind():
+            # Cache and queue are updated together so they agree on order
+            _write_queue.put(row)
+            return
 
-    conn.commit()
-    conn.close()
+    _flush_session(session_id)
+    with _connection() as conn:
+        conn.execute(SQL_INSERT_MESSAGE, row)
+        _advance_generations(conn, [session_id])
 
 
 def get_recent_messages(session_id: str, limit: int = 6):
     """Get recent messages for active session only"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Check if session exists and is active
-    cur.execute("""
-    SELECT is_active FROM sessions WHERE session_id = ?
-    """, (session_id,))
-    
-    result = cur.fetchone()
-    if not result or result[0] == 0:
-        # Session doesn't exist or is inactive - return empty history
-        conn.close()
-        return []
-
-    # Get recent messages
-    cur.execute("""
-    SELECT role, content
-    FROM messages
-    WHERE session_id = ?
-    ORDER BY id DESC
-    LIMIT ?
-    """, (session_id, limit))
-
-    rows = cur.fetchall()
-    conn.close()
+    if _history_cache.contains(session_id):
+        cached = _history_cache.get(session_id, limit, _session_generation(session_id))
+        if cached is not None:
+            return cached
+
+    _flush_session(session_id)
+    with _connection() as conn:
+        # Check if session exists and is active
+        result = conn.execute(SQL_SESSION_STATUS, (session_id,)).fetchone()
+        if not result or result[0] == 0:
+            # Session doesn't exist or is inactive - return empty history
+            return []
+
+        # Get recent messages
+        rows = conn.execute(SQL_RECENT_MESSAGES, (session_id, limit)).fetchall()
 
     return list(reversed(rows))
 
 
 def clear_session(session_id: str):
     """Clear all messages for a session and mark as inactive"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Delete all messages
-    cur.execute("""
-    DELETE FROM messages WHERE session_id = ?
-    """, (session_id,))
+    _history_cache.invalidate(session_id)
+    _flush_session(session_id)
 
-    # Mark session as inactive
-    cur.execute("""
-    UPDATE sessions SET is_active = 0 WHERE session_id = ?
-    """, (session_id,))
+    with _connection() as conn:
+        # Delete all messages and the summary of them
+        conn.execute(SQL_DELETE_MESSAGES, (session_id,))
+        conn.execute(SQL_DELETE_SUMMARY, (session_id,))
 
-    conn.commit()
-    conn.close()
+        # Mark session as inactive
+        conn.execute(SQL_DEACTIVATE_SESSION, (session_id,))
 
 
 def activate_session(session_id: str):
     """Reactivate a session (used when starting fresh)"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    cur.execute("""
-    UPDATE sessions SET is_active = 1 WHERE session_id = ?
-    """, (session_id,))
-
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with _connection() as conn:
+        conn.execute(SQL_ACTIVATE_SESSION, (session_id,))
+
+
+def get_session_summary(session_id: str):
+    """Return (summary, last_message_id) or (None, 0) if not summarized yet"""
+    with _connection() as conn:
+        row = conn.execute(SQL_GET_SUMMARY, (session_id,)).fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+
+def save_session_summary(session_id: str, summary: str, last_message_id: int):
+    with _connection() as conn:
+        conn.execute(
+            SQL_SAVE_SUMMARY,
+            (session_id, summary, last_message_id, datetime.utcnow().isoformat())
+        )
+
+
+def get_messages_after(session_id: str, after_id: int):
+    """Messages with id > after_id as (id, role, content), oldest first"""
+    _flush_session(session_id)
+    with _connection() as conn:
+        return conn.execute(SQL_MESSAGES_AFTER, (session_id, after_id)).fetchall()
+
+
+def begin_chat_turn(session_id: str, user_message: str, limit: int = 6):
+    """Pre-LLM part of a chat turn in a single transaction.
+
+    Creates/reactivates the session, stores the user message and returns
+    the recent history (including that message). Equivalent to calling
+    create_session_if_not_exists, activate_session, save_message and
+    get_recent_messages, but with one commit and no interleaving writes
+    from other requests on the same session.
+    """
+    now = datetime.utcnow().isoformat()
+    row = (session_id, "user", user_message, now)
+
+    if _write_behind() and _history_cache.contains(session_id):
+        # Hot session: if the database still has the generation it was
+        # cached at (no other worker wrote to, cleared or purged it), the
+        # turn is served from memory and the insert goes to the
+        # write-behind queue
+        generation = _session_generation(session_id)
+        with _history_cache.lock:
+            hot = _history_cache.is_current(session_id, generation) \
+                and _history_cache.append(session_id, "user", user_message)
+            if hot:
+                _write_queue.put(row)
+                cached = _history_cache.get(session_id, limit, generation)
+        if hot:
+            if cached is not None:
+                return cached
+            # More history requested than is cached
+            return get_recent_messages(session_id, limit)
+
+    _flush_session(session_id)
+
+    with _connection(immediate=True) as conn:
+        conn.execute(SQL_UPSERT_ACTIVE_SESSION, (session_id, now))
+        conn.execute(SQL_INSERT_MESSAGE, row)
+        rows = conn.execute(
+            SQL_RECENT_MESSAGES,
+            (session_id, max(limit, HISTORY_CACHE_DEPTH))
+        ).fetchall()
+        rows = list(reversed(rows))
+        generation = conn.execute(SQL_SESSION_STATUS, (session_id,)).fetchone()[1]
+
+        # Loaded while holding the write lock so concurrent cold turns on
+        # the same session populate the cache in commit order
+        _history_cache.load(session_id, rows, generation)
+
+    return rows[-limit:] if limit > 0 else []
+
+
+def finish_chat_turn(session_id: str, assistant_message: str):
+    """Post-LLM part of a chat turn: append the assistant reply"""
+    save_message(session_id, "assistant", assistant_message)
+
+
+# Don't lose queued writes if the process exits without a shutdown event
+atexit.register(flush_messages)
@@ -0,0 +1,250 @@
+# Path: backend/snapshot.py
+# Purpose: Memory-mapped binary index snapshot for fast cold start
+# Design:
+# - embeddings.npy : normalized embedding matrix, opened with mmap
+#                    (float16 files are loaded as a float32 copy)
+# - texts.bin      : UTF-8 node texts back to back
+# - offsets.npy    : int64 byte offsets into texts.bin (count + 1 entries)
+# - bm25/          : BM25 postings as .npy arrays (bm25.py), opened with mmap
+# - manifest.json  : node ids, metadata and a fingerprint of the JSON storage
+# Workers open the files read-only and share pages through the OS cache;
+# node text is only decoded for the top-k hits.
+#
+# Convert existing JSON storage:  python snapshot.py
+
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import (
+    MetadataMode,
+    NodeRelationship,
+    ObjectType,
+    RelatedNodeInfo,
+    TextNode
+)
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryResult
+)
+
+from vector_store import NumpyVectorStore
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 3
+MANIFEST_FNAME = "manifest.json"
+EMBEDDINGS_FNAME = "embeddings.npy"
+TEXTS_FNAME = "texts.bin"
+OFFSETS_FNAME = "offsets.npy"
+IVF_FNAME = "ivf.npz"
+BM25_DIRNAME = "bm25"
+
+# JSON storage files whose change makes a snapshot stale
+_FINGERPRINT_FILES = (
+    "docstore.json",
+    "index_store.json",
+    "default__vector_store.npy",
+    "default__vector_store.ids.json",
+)
+
+
+def storage_fingerprint(storage_dir: Path) -> str:
+    h = hashlib.sha1()
+    for name in _FINGERPRINT_FILES:
+        path = Path(storage_dir) / name
+        if path.exists():
+            stat = path.stat()
+            h.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return h.hexdigest()
+
+
+def snapshot_is_fresh(snapshot_dir: Path, storage_dir: Path) -> bool:
+    manifest_path = Path(snapshot_dir) / MANIFEST_FNAME
+    if not manifest_path.exists():
+        return False
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (
+        manifest.get("format_version") == SNAPSHOT_FORMAT_VERSION
+        and manifest.get("storage_fingerprint") == storage_fingerprint(storage_dir)
+    )
+
+
+def write_snapshot(vector_store: NumpyVectorStore, docstore,
+                   snapshot_dir: Path, storage_dir: Path):
+    """Write a snapshot of an index's vector store + docstore"""
+    snapshot_dir = Path(snapshot_dir)
+    # Per process: never clear a directory another process is writing
+    tmp_dir = snapshot_dir.with_name(f"{snapshot_dir.name}.tmp{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    ids = vector_store.node_ids
+    nodes = []
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+
+    with open(tmp_dir / TEXTS_FNAME, "wb") as f:
+        for i, node_id in enumerate(ids):
+            node = docstore.get_node(node_id)
+            data = node.get_content(metadata_mode=MetadataMode.NONE).encode("utf-8")
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+            nodes.append({
+                "ref_doc_id": node.ref_doc_id,
+                "metadata": node.metadata,
+                "excluded_embed_metadata_keys": node.excluded_embed_metadata_keys,
+                "excluded_llm_metadata_keys": node.excluded_llm_metadata_keys,
+            })
+
+    np.save(
+        tmp_dir / EMBEDDINGS_FNAME,
+        np.ascontiguousarray(vector_store.matrix, dtype=vector_store.dtype)
+    )
+    np.save(tmp_dir / OFFSETS_FNAME, offsets)
+    if vector_store.ensure_ann():
+        vector_store._ann.save(tmp_dir / IVF_FNAME)
+    vector_store.ensure_bm25().save(tmp_dir / BM25_DIRNAME)
+
+    # Manifest last: a snapshot without one is never loaded
+    with open(tmp_dir / MANIFEST_FNAME, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "format_version": SNAPSHOT_FORMAT_VERSION,
+                "storage_fingerprint": storage_fingerprint(storage_dir),
+                "dtype": vector_store.dtype,
+                "count": len(ids),
+                "ids": ids,
+                "nodes": nodes
+            },
+            f
+        )
+
+    # Move the old snapshot aside first: readers see a missing snapshot
+    # only between two renames, and keep their mappings of the old files
+    old_dir = snapshot_dir.with_name(f"{snapshot_dir.name}.old{os.getpid()}")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if snapshot_dir.exists():
+        snapshot_dir.rename(old_dir)
+    tmp_dir.rename(snapshot_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logger.info(f"💾 Wrote index snapshot ({len(ids)} nodes) to {snapshot_dir}")
+
+
+class SnapshotVectorStore(NumpyVectorStore):
+    """Read-only vector store over a memory-mapped snapshot.
+
+    Stores text, so VectorStoreIndex.from_vector_store() needs no docstore.
+    """
+
+    stores_text: bool = True
+
+    _texts: Any = PrivateAttr(default=None)
+    _offsets: Any = PrivateAttr(default=None)
+    _nodes: List[dict] = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SnapshotVectorStore"
+
+    @classmethod
+    def from_snapshot_dir(cls, snapshot_dir: Path, **kwargs: Any) -> "SnapshotVectorStore":
+        """kwargs are store settings (index_mode, ivf_probe, ...)"""
+        snapshot_dir = Path(snapshot_dir)
+        with open(snapshot_dir / MANIFEST_FNAME, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        store = cls(dtype=manifest["dtype"], **kwargs)
+        store._data = np.load(snapshot_dir / EMBEDDINGS_FNAME, mmap_mode="r")
+        if store._data.dtype != np.float32:
+            # float16 on disk: scored as a float32 copy, not the mapping
+            store._data = np.asarray(store._data, dtype=np.float32)
+        store._size = manifest["count"]
+        store._ids = manifest["ids"]
+        store._nodes = manifest["nodes"]
+        store._ref_doc_ids = [n["ref_doc_id"] for n in store._nodes]
+        store._metadata = [n["metadata"] for n in store._nodes]
+        store._offsets = np.load(snapshot_dir / OFFSETS_FNAME)
+        if store._offsets[-1] > 0:
+            store._texts = np.memmap(snapshot_dir / TEXTS_FNAME, dtype=np.uint8, mode="r")
+        store._load_ann(snapshot_dir / IVF_FNAME)
+        store._terms = None  # read-only: term counts only as BM25 arrays
+        store._load_bm25(snapshot_dir / BM25_DIRNAME)
+        return store
+
+    def _text(self, row: int) -> str:
+        start, end = self._offsets[row], self._offsets[row + 1]
+        if start == end:
+            return ""
+        return bytes(self._texts[start:end]).decode("utf-8")
+
+    def _node(self, row: int) -> TextNode:
+        info = self._nodes[row]
+        relationships = {}
+        if info["ref_doc_id"]:
+            relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(
+                node_id=info["ref_doc_id"], node_type=ObjectType.DOCUMENT
+            )
+        return TextNode(
+            id_=self._ids[row],
+            text=self._text(row),
+            metadata=dict(info["metadata"]),
+            excluded_embed_metadata_keys=info["excluded_embed_metadata_keys"],
+            excluded_llm_metadata_keys=info["excluded_llm_metadata_keys"],
+            relationships=relationships
+        )
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.node_ids is not None and not query.node_ids:
+            # An index over a text-storing store has an empty nodes_dict,
+            # so as_retriever() sends node_ids=[] meaning "no restriction"
+            query = dataclasses.replace(query, node_ids=None)
+
+        positions, similarities, ids = self._search(query)
+        return VectorStoreQueryResult(
+            nodes=[self._node(int(row)) for row in positions],
+            similarities=similarities,
+            ids=ids
+        )
+
+    def add(self, nodes, **add_kwargs):
+        raise NotImplementedError("Snapshots are read-only; rebuild from storage")
+
+    def delete(self, ref_doc_id: str, **delete_kwargs):
+        raise NotImplementedError("Snapshots are read-only; rebuild from storage")
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        raise NotImplementedError("Snapshots are read-only; rebuild from storage")
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        # Nothing to persist: the snapshot files are the storage
+        return None
+
+
+def convert_storage(storage_dir: Path, snapshot_dir: Path, dtype: str = "float32",
+                    **kwargs: Any):
+    """Build a snapshot from the JSON storage files (no models needed)"""
+    docstore = SimpleDocumentStore.from_persist_dir(str(storage_dir))
+    vector_store = NumpyVectorStore.from_persist_dir(
+        str(storage_dir), dtype=dtype, **kwargs
+    )
+    write_snapshot(vector_store, docstore, snapshot_dir, storage_dir)
+
+
+if __name__ == "__main__":
+    from config import STORAGE_DIR, SNAPSHOT_DIR, VECTOR_STORE_DTYPE, VECTOR_STORE_SETTINGS
+
+    logging.basicConfig(level=logging.INFO)
+    convert_storage(STORAGE_DIR, SNAPSHOT_DIR, VECTOR_STORE_DTYPE, **VECTOR_STORE_SETTINGS)
@@ -0,0 +1,81 @@
+# Path: backend/summarizer.py
+# Purpose: Rolling per-session conversation summaries
+# Design:
+# - The prompt carries the summary + every message after the last one it
+#   covers (normally the last SUMMARY_KEEP_MESSAGES)
+# - Older messages are folded into the summary after the response is sent
+# - One update per session at a time; failures keep the previous summary
+
+import logging
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import SUMMARY_KEEP_MESSAGES, SUMMARY_MAX_TOKENS
+from session_store import (
+    get_session_summary,
+    save_session_summary,
+    get_messages_after
+)
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a customer and Lora, a finance assistant.
+Keep the loan type(s) discussed, facts the customer shared and what was already answered.
+Write at most 4 short sentences.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+
+class ConversationSummarizer:
+
+    def __init__(self, llm, keep_messages: int = SUMMARY_KEEP_MESSAGES):
+        self.llm = llm
+        self.keep_messages = keep_messages
+        self._in_progress = set()
+
+    async def update(self, session_id: str):
+        """Fold messages that left the history window into the summary"""
+        if session_id in self._in_progress:
+            return
+
+        self._in_progress.add(session_id)
+        try:
+            summary, last_id = await run_in_threadpool(
+                get_session_summary, session_id
+            )
+            rows = await run_in_threadpool(get_messages_after, session_id, last_id)
+
+            to_fold = rows[:-self.keep_messages] if self.keep_messages else rows
+            if not to_fold:
+                return
+
+            messages = "\n".join(
+                f"{'User' if role == 'user' else 'Assistant'}: {content}"
+                for _, role, content in to_fold
+            )
+            response = await self.llm.acomplete(
+                SUMMARY_PROMPT.format(
+                    summary=summary or "(none)",
+                    messages=messages
+                ),
+                max_tokens=SUMMARY_MAX_TOKENS
+            )
+
+            await run_in_threadpool(
+                save_session_summary,
+                session_id,
+                str(response).strip(),
+                to_fold[-1][0]
+            )
+
+        except Exception as e:
+            logger.error(f"Summary update failed for {session_id}: {e}")
+
+        finally:
+            self._in_progress.discard(session_id)
@@ -0,0 +1,513 @@
+# Path: backend/vector_store.py
+# Purpose: NumPy-backed vector store for the LlamaIndex index
+# Design:
+# - Embeddings live in one contiguous, L2-normalized float32 matrix; dtype
+#   "float16" only halves the persisted files (NumPy has no BLAS path for
+#   half precision, so scoring float16 directly is several times slower)
+# - Top-k is a single matmul + argpartition (cosine similarity)
+# - Persisted as <name>.npy + <name>.ids.json (+ <name>.bm25/ postings
+#   arrays) next to the other storage files
+# - Existing SimpleVectorStore JSON files are converted on first load
+# - Optional IVF mode (ann.py) scores only the closest cells for large corpora
+# - Optional partition_key splits the rows into sub-indexes by one metadata
+#   value; EQ/IN filters on it search only those rows, with no filter scan
+# - Hybrid mode fuses the dense ranking with BM25 (bm25.py) over per-node
+#   term counts taken at ingestion, by reciprocal rank fusion
+
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, List, Optional
+
+import numpy as np
+
+from ann import IVFIndex
+from bm25 import BM25Index, term_counts
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.simple import (
+    DEFAULT_VECTOR_STORE,
+    NAMESPACE_SEP
+)
+from llama_index.core.vector_stores.types import (
+    DEFAULT_PERSIST_DIR,
+    DEFAULT_PERSIST_FNAME,
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _store_paths(persist_path: str):
+    """<dir>/default__vector_store.json -> (.npy, .ids.json, .ivf.npz,
+    .bm25/) siblings"""
+    path = Path(persist_path)
+    return (
+        path.with_suffix(".npy"),
+        path.with_suffix(".ids.json"),
+        path.with_suffix(".ivf.npz"),
+        path.with_suffix(".bm25")
+    )
+
+
+def _matches(metadata: dict, filters: MetadataFilters) -> bool:
+    results = []
+    for f in filters.filters:
+        if isinstance(f, MetadataFilters):
+            results.append(_matches(metadata, f))
+            continue
+
+        value = metadata.get(f.key)
+        if f.operator == FilterOperator.EQ:
+            results.append(value == f.value)
+        elif f.operator == FilterOperator.NE:
+            results.append(value != f.value)
+        elif f.operator == FilterOperator.IN:
+            results.append(value in f.value)
+        elif f.operator == FilterOperator.NIN:
+            results.append(value not in f.value)
+        else:
+            raise ValueError(f"Unsupported filter operator: {f.operator}")
+
+    if filters.condition == FilterCondition.OR:
+        return any(results)
+    return all(results)
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """In-memory vector store with a contiguous normalized embedding matrix"""
+
+    stores_text: bool = False
+    # Persisted / snapshot format; rows are held and scored as float32
+    dtype: str = "float32"
+
+    # "exact" scores every row; "ivf" scores the ivf_probe closest of
+    # ivf_lists cells (0 = sqrt(rows)) once there are ann_min_nodes rows
+    index_mode: str = "exact"
+    ivf_lists: int = 0
+    ivf_probe: int = 8
+    ann_min_nodes: int = 2000
+
+    # Metadata key whose values partition the rows (e.g. "loan_type")
+    partition_key: Optional[str] = None
+
+    # Hybrid queries fuse the top sparse_top_k dense and BM25 rows with
+    # reciprocal rank fusion, score = sum of 1 / (rrf_k + rank)
+    sparse_top_k: int = 10
+    rrf_k: int = 60
+
+    _ann: Any = PrivateAttr(default=None)
+    _partitions: Any = PrivateAttr(default=None)
+    _bm25: Any = PrivateAttr(default=None)
+    # Per-row term counts; None when loaded as BM25 arrays only, rebuilt
+    # from them on the first change
+    _terms: Optional[List[dict]] = PrivateAttr(default_factory=list)
+    _data: Any = PrivateAttr(default=None)
+    _size: int = PrivateAttr(default=0)
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _metadata: List[dict] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """View of the stored (normalized) embeddings"""
+        if self._data is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._data[:self._size]
+
+    @property
+    def node_ids(self) -> List[str]:
+        return list(self._ids)
+
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _row_terms(self) -> List[dict]:
+        """Per-row term counts, call with the lock held"""
+        if self._terms is None:
+            self._terms = (
+                self._bm25.row_terms() if self._bm25 is not None
+                else [{} for _ in range(self._size)]
+            )
+        return self._terms
+
+    def _append_rows(self, rows: np.ndarray):
+        if self._data is None:
+            self._data = np.empty((max(len(rows), 64), rows.shape[1]), dtype=np.float32)
+        elif self._size + len(rows) > len(self._data):
+            # Grow geometrically so repeated adds stay amortized O(1)
+            capacity = max(self._size + len(rows), 2 * len(self._data))
+            grown = np.empty((capacity, self._data.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+
+        self._data[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+        self._ann = None
+        self._partitions = None
+        self._bm25 = None
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+
+        rows = self._normalize([node.get_embedding() for node in nodes])
+        terms = [
+            term_counts(node.get_content(metadata_mode=MetadataMode.EMBED))
+            for node in nodes
+        ]
+
+        with self._lock:
+            self._row_terms().extend(terms)
+            self._append_rows(rows)
+            for node in nodes:
+                self._ids.append(node.node_id)
+                self._ref_doc_ids.append(node.ref_doc_id)
+                self._metadata.append(dict(node.metadata))
+
+        return [node.node_id for node in nodes]
+
+    def _keep_rows(self, keep: np.ndarray):
+        kept = np.flatnonzero(keep)
+        row_terms = self._row_terms()
+        self._data = np.ascontiguousarray(self._data[:self._size][kept])
+        self._size = len(kept)
+        self._ids = [self._ids[i] for i in kept]
+        self._ref_doc_ids = [self._ref_doc_ids[i] for i in kept]
+        self._metadata = [self._metadata[i] for i in kept]
+        self._terms = [row_terms[i] for i in kept]
+        self._ann = None
+        self._partitions = None
+        self._bm25 = None
+
+    def ensure_ann(self) -> bool:
+        """Build the IVF index if the mode asks for it and it is missing or
+        stale. Returns whether searches will use it."""
+        if self.index_mode != "ivf" or self._size < self.ann_min_nodes:
+            return False
+
+        with self._lock:
+            if self._ann is None or self._ann.n_rows != self._size:
+                self._ann = IVFIndex.build(self.matrix, self.ivf_lists or None)
+        return True
+
+    def _get_partitions(self) -> dict:
+        """partition_key value -> row numbers, rebuilt after changes.
+        Call with the lock held."""
+        if self._partitions is None:
+            groups = {}
+            for row, metadata in enumerate(self._metadata[:self._size]):
+                groups.setdefault(metadata.get(self.partition_key), []).append(row)
+            self._partitions = {
+                value: np.asarray(rows, dtype=np.int64)
+                for value, rows in groups.items()
+            }
+        return self._partitions
+
+    def _get_bm25(self) -> BM25Index:
+        """Inverted index over the rows, rebuilt after changes. Call with
+        the lock held."""
+        if self._bm25 is None:
+            self._bm25 = BM25Index(self._row_terms()[:self._size])
+        return self._bm25
+
+    def ensure_bm25(self) -> BM25Index:
+        """Build the BM25 index now rather than on the first hybrid query"""
+        with self._lock:
+            return self._get_bm25()
+
+    def _load_bm25(self, path: Path):
+        """Use persisted BM25 postings (memory-mapped) if they match the
+        loaded rows"""
+        if not path.is_dir():
+            return
+        try:
+            bm25 = BM25Index.load(path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable BM25 index {path}: {e}")
+            return
+        if bm25.n_rows == self._size:
+            self._bm25 = bm25
+            self._terms = None
+
+    def partition_values(self) -> List[Any]:
+        """Values of partition_key present in the store"""
+        if self.partition_key is None:
+            return []
+        with self._lock:
+            return list(self._get_partitions())
+
+    def _partition_rows(self, query: VectorStoreQuery,
+                        partitions: Optional[dict]) -> Optional[np.ndarray]:
+        """Rows for a query restricted only by one EQ/IN filter on
+        partition_key, None if the query is anything else"""
+        if partitions is None or query.doc_ids is not None \
+                or query.node_ids is not None or query.filters is None \
+                or len(query.filters.filters) != 1:
+            return None
+
+        f = query.filters.filters[0]
+        if isinstance(f, MetadataFilters) or f.key != self.partition_key:
+            return None
+        if f.operator == FilterOperator.EQ:
+            values = [f.value]
+        elif f.operator == FilterOperator.IN:
+            values = f.value
+        else:
+            return None
+
+        parts = [partitions[v] for v in values if v in partitions]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            keep = np.array(
+                [doc_id != ref_doc_id for doc_id in self._ref_doc_ids],
+                dtype=bool
+            )
+            if not keep.all():
+                self._keep_rows(keep)
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None,
+                     filters: Optional[MetadataFilters] = None,
+                     **delete_kwargs: Any) -> None:
+        with self._lock:
+            drop = set(node_ids or [])
+            keep = np.array(
+                [
+                    node_id not in drop
+                    and not (filters is not None and _matches(metadata, filters))
+                    for node_id, metadata in zip(self._ids, self._metadata)
+                ],
+                dtype=bool
+            )
+            if not keep.all():
+                self._keep_rows(keep)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data = None
+            self._size = 0
+            self._ann = None
+            self._partitions = None
+            self._bm25 = None
+            self._ids = []
+            self._ref_doc_ids = []
+            self._metadata = []
+            self._terms = []
+
+    @staticmethod
+    def _candidate_rows(query: VectorStoreQuery, ids, ref_doc_ids,
+                        metadata) -> Optional[np.ndarray]:
+        """Row numbers allowed by the query's restrictions, None for all"""
+        if query.filters is None and query.doc_ids is None and query.node_ids is None:
+            return None
+
+        doc_ids = set(query.doc_ids) if query.doc_ids is not None else None
+        node_ids = set(query.node_ids) if query.node_ids is not None else None
+
+        rows = [
+            i for i in range(len(ids))
+            if (doc_ids is None or ref_doc_ids[i] in doc_ids)
+            and (node_ids is None or ids[i] in node_ids)
+            and (query.filters is None or _matches(metadata[i], query.filters))
+        ]
+        return np.asarray(rows, dtype=np.int64)
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first"""
+        k = min(k, len(scores))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def _fuse(self, dense_rows: np.ndarray, sparse_rows: np.ndarray, k: int):
+        """Reciprocal rank fusion of two best-first row lists"""
+        fused = {}
+        for ranking in (dense_rows, sparse_rows):
+            for rank, row in enumerate(ranking.tolist()):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        best = sorted(fused.items(), key=lambda item: -item[1])[:k]
+        return (
+            np.asarray([row for row, _ in best], dtype=np.int64),
+            np.asarray([score for _, score in best], dtype=np.float32)
+        )
+
+    def _search(self, query: VectorStoreQuery):
+        """Top-k rows for the query: (row numbers, similarities, node ids)"""
+        hybrid = query.mode == VectorStoreQueryMode.HYBRID
+        if query.mode != VectorStoreQueryMode.DEFAULT and not hybrid:
+            raise ValueError(f"{self.class_name()} does not support mode {query.mode}")
+        if query.query_embedding is None:
+            raise ValueError("Query embedding is required")
+
+        # Consistent snapshot; the matmul itself runs without the lock
+        with self._lock:
+            matrix = self.matrix
+            ann = self._ann
+            partitions = self._get_partitions() if self.partition_key else None
+            bm25 = self._get_bm25() if hybrid and query.query_str else None
+            ids = self._ids[:self._size]
+            ref_doc_ids = self._ref_doc_ids[:self._size]
+            metadata = self._metadata[:self._size]
+
+        vector = self._normalize(query.query_embedding)
+
+        # Rows allowed by the query's restrictions (None = all)
+        rows = self._partition_rows(query, partitions)
+        if rows is None:
+            rows = self._candidate_rows(query, ids, ref_doc_ids, metadata)
+
+        dense_rows = rows
+        if rows is None and ann is not None and ann.n_rows == len(matrix):
+            dense_rows = ann.candidates(vector, self.ivf_probe)
+
+        k = query.similarity_top_k
+        n_dense = max(k, query.sparse_top_k or self.sparse_top_k) if bm25 else k
+
+        dense_matrix = matrix[dense_rows] if dense_rows is not None else matrix
+        dense_scores = dense_matrix @ vector
+        top = self._top(dense_scores, n_dense)
+        positions = dense_rows[top] if dense_rows is not None else top
+        scores = dense_scores[top].astype(np.float32)
+
+        sparse_scores = bm25.scores(query.query_str) if bm25 is not None else None
+        if sparse_scores is not None:
+            if rows is not None:
+                sparse_scores = sparse_scores[rows]
+            sparse_top = self._top(sparse_scores, n_dense)
+            sparse_top = sparse_top[sparse_scores[sparse_top] > 0]
+            sparse_positions = rows[sparse_top] if rows is not None else sparse_top
+            positions, scores = self._fuse(positions, sparse_positions, k)
+        else:
+            positions, scores = positions[:k], scores[:k]
+
+        return (
+            positions,
+            scores.tolist(),
+            [ids[i] for i in positions]
+        )
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        _, similarities, ids = self._search(query)
+        return VectorStoreQueryResult(nodes=None, similarities=similarities, ids=ids)
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        matrix_path, ids_path, ivf_path, bm25_path = _store_paths(persist_path)
+        matrix_path.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.ensure_ann():
+            self._ann.save(ivf_path)
+        elif ivf_path.exists():
+            ivf_path.unlink()
+        self.ensure_bm25().save(bm25_path)
+
+        with self._lock:
+            np.save(matrix_path, np.ascontiguousarray(self.matrix, dtype=self.dtype))
+            with open(ids_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "dtype": self.dtype,
+                        "ids": self._ids,
+                        "ref_doc_ids": self._ref_doc_ids,
+                        "metadata": self._metadata
+                    },
+                    f
+                )
+
+    def _load_arrays(self, matrix: np.ndarray, ids, ref_doc_ids, metadata,
+                     terms=None):
+        self._data = np.ascontiguousarray(matrix, dtype=np.float32)
+        self._size = len(ids)
+        self._ids = list(ids)
+        self._ref_doc_ids = list(ref_doc_ids)
+        self._metadata = list(metadata)
+        # Term counts are persisted as BM25 arrays (_load_bm25); older
+        # stores had them here, or none at all
+        self._terms = list(terms) if terms is not None else [{} for _ in ids]
+
+    def _load_ann(self, path: Path):
+        """Use a persisted IVF index if it matches the loaded rows"""
+        if self.index_mode != "ivf" or not path.exists():
+            return
+        try:
+            ann = IVFIndex.load(path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable IVF index {path}: {e}")
+            return
+        if ann.n_rows == self._size:
+            self._ann = ann
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, dtype: str = "float32",
+                          fs: Any = None, **kwargs: Any) -> "NumpyVectorStore":
+        """Load <name>.npy/.ids.json, or convert a SimpleVectorStore JSON
+        file at persist_path if that is all there is. kwargs are store
+        settings (index_mode, ivf_lists, ...)"""
+        store = cls(dtype=dtype, **kwargs)
+        matrix_path, ids_path, ivf_path, bm25_path = _store_paths(persist_path)
+
+        if matrix_path.exists() and ids_path.exists():
+            with open(ids_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            store._load_arrays(
+                np.load(matrix_path),
+                meta["ids"],
+                meta["ref_doc_ids"],
+                meta["metadata"],
+                meta.get("terms")
+            )
+            store._load_ann(ivf_path)
+            store._load_bm25(bm25_path)
+        elif Path(persist_path).exists():
+            logger.info(f"Converting {persist_path} to a NumPy vector store")
+            with open(persist_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            ids = list(data.get("embedding_dict", {}).keys())
+            text_to_doc = data.get("text_id_to_ref_doc_id", {})
+            metadata = data.get("metadata_dict", {})
+            embeddings = [data["embedding_dict"][node_id] for node_id in ids]
+
+            if ids:
+                store._load_arrays(
+                    store._normalize(embeddings),
+                    ids,
+                    [text_to_doc.get(node_id) for node_id in ids],
+                    [metadata.get(node_id, {}) for node_id in ids]
+                )
+            store.persist(persist_path)
+
+        return store
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str = DEFAULT_PERSIST_DIR,
+                         namespace: str = DEFAULT_VECTOR_STORE,
+                         dtype: str = "float32",
+                         fs: Any = None, **kwargs: Any) -> "NumpyVectorStore":
+        persist_path = Path(persist_dir) / f"{namespace}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}"
+        return cls.from_persist_path(str(persist_path), dtype=dtype, fs=fs, **kwargs)